@@ -0,0 +1,43 @@
+#encoding: utf-8
+
+from __future__ import annotations
+from dataclasses import dataclass
+
+# Arguments of a program declared with an ABI are not packed into Ans. The
+# first ones go to reserved letters, the others to a fixed window at the top
+# of ⌊RAM. Both are caller-saved: a callee copies its arguments before
+# calling anything else. Results still come back in Ans.
+
+ARG_REGS: tuple[str, ...] = ("X", "Y", "Z")
+ARG_WINDOW = 32
+# ⌊RAM is dimensioned to this by HNINIT, the window is its last elements
+RAM_WORDS = 999
+ARG_WINDOW_START = RAM_WORDS - ARG_WINDOW + 1
+
+@dataclass(frozen=True)
+class Abi:
+	name: str
+	regs: int = len(ARG_REGS)
+
+	class TooManyArgs(Exception): ...
+
+	def arg(self, i: int) -> str:
+		"""returns where argument i is passed"""
+
+		if i < self.regs:
+			return ARG_REGS[i]
+
+		if i - self.regs >= ARG_WINDOW:
+			raise self.TooManyArgs(f"{self.name} cannot take more than {self.regs + ARG_WINDOW} arguments")
+
+		return f"⌊RAM({ARG_WINDOW_START + i - self.regs})"
+
+	def window(self, offset: str) -> str:
+		"""returns the window slot holding the argument at regs + offset, offset being an expression"""
+		return f"⌊RAM({ARG_WINDOW_START}+{offset})"
+
+RUNTIME_ABIS: dict[str, Abi] = {abi.name: abi for abi in (
+	Abi("HNALLOC", regs=1), # size, then the initial values in the window
+	Abi("HNALLVEC", regs=1), # size
+	Abi("HNFREE", regs=1), # handle
+)}
@@ -0,0 +1,239 @@
+#encoding: utf-8
+
+from __future__ import annotations
+import argparse
+import json
+import random
+import subprocess
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Callable
+
+import front
+import trans
+from trans import (
+	Const, Disp, ExprRoot, For, MedVar, NumVal, NumRaw, Scope, SmallVar, StructInstance, VarPlanner, Vector, While, get_num_val, new_locator
+)
+
+# Benchmarks of the compiler itself. Each one builds a large synthetic program
+# and times a part of the compilation, results are appended to a JSON history
+# keyed by commit so that compile time regressions show up between commits.
+
+HISTORY = "bench.json"
+# a benchmark slower than this many times its last recorded time is reported
+REGRESSION = 1.2
+
+def deep_expression(rng: random.Random, depth: int) -> NumVal:
+	"""returns an expression tree depth operators deep, built like scripts do with the operators of NumOp"""
+
+	if depth == 0:
+		return NumRaw(rng.choice("ABCDEFGH")) if rng.random() < 0.7 else Const(rng.randint(1, 9))
+
+	a, b = deep_expression(rng, depth - 1), deep_expression(rng, rng.randrange(depth))
+	return rng.choice((a + b, a - b, a * b, a / Const(rng.randint(1, 9)), a * Const(2), (a < b) & (b > Const(1))))
+
+def many_med_vars(count: int):
+	"""declares count MedVars, a scope at a time as there are less ⌊RAM slots than that"""
+
+	for _ in range(count // 100):
+		with Scope():
+			for n in range(100):
+				MedVar(str(n)).set(NumRaw("Rep") + Const(n))
+
+def nested_loops(depth: int, width: int):
+	"""nests For and While loops depth levels deep, with width statements in each"""
+
+	if depth == 0:
+		return
+
+	var = SmallVar()
+	var.set(Const(0))
+
+	with While(var < Const(width)):
+
+		var.incr()
+
+		with For(..., Const(1), var) as fl:
+
+			for n in range(width):
+				var.set(var + fl.var * Const(n))
+
+			nested_loops(depth - 1, width)
+
+	var.free()
+
+def many_structs(count: int):
+	"""creates count struct instances and vectors, reading and writing their members"""
+
+	for n in range(count):
+		with Scope():
+
+			instance = StructInstance((("x", Const(n)), ("y", Const(1))))
+			instance.get_member("x").set(instance.get_member("x") + instance.get_member("y"))
+			vector = Vector(Const(4))
+			vector.init([Const(n), instance.get_member("x")])
+			vector.push(instance.get_member("y"))
+			Disp(vector[Const(0)])
+
+def concept_source(functions: int, statements: int) -> str:
+	"""returns a program of the concept language with functions functions holding loops and structs,
+	and a main part of statements statements calling them"""
+
+	lines = ["struct P { x: num, y: num }", "impl P {", "\tfn norm1(self: &Self) -> num { self.x + self.y }", "}"]
+
+	for n in range(functions):
+		lines += [
+			f"fn f{n}(a: num, b: num) -> num {{",
+			"\tacc: num = 0;",
+			"\tfor (i, 0, a) { acc += i * b; if acc > 100 { acc = acc - 100; } }",
+			"\twhile acc > 10 { acc = acc / 2; }",
+			"\tp: P = P { x: acc, y: b };",
+			"\tacc + p.norm1() * 2 - a",
+			"}",
+		]
+
+	# taking its address keeps q from being evaluated at compile time
+	lines += ["q: num = 4;", "r: *num = *q;"]
+	lines += [f"q = f{n % functions}(q, q + {n}) + f{(n + 1) % functions}(q + 1, q) * {n};" for n in range(statements)]
+	lines.append("Disp(q);")
+	return "\n".join(lines)
+
+# a benchmark sets up what it needs, then the part timed runs on it
+Benchmark = tuple[Callable[[], object], Callable[[object], object]]
+
+def _expressions() -> list[NumVal]:
+
+	rng = random.Random(0)
+	return [deep_expression(rng, 7) for _ in range(50)]
+
+def _big_program() -> trans.TargetCode:
+
+	new_locator()
+	many_med_vars(5000)
+	nested_loops(4, 4)
+	many_structs(300)
+	return trans.Locator.target_code
+
+def _var_planner() -> VarPlanner:
+	return VarPlanner("bench", [str(n) for n in range(1, 968)])
+
+def _cycle_planner(planner: VarPlanner):
+
+	for _ in range(50):
+
+		elements = [planner.get_allocated() for _ in range(900)]
+
+		for e in elements:
+			planner.free(e)
+
+def _many_nodes(_) -> list[NumVal]:
+	"""keeps the trees of many small expressions alive at once, as large scripts do, and simplifies them"""
+
+	trees = [NumRaw("A") * Const(n) + NumRaw("B") / Const(3) - Const(1) for n in range(50000)]
+
+	for tree in trees:
+		ExprRoot(tree).simplified_root()
+
+	return trees
+
+BENCHMARKS: dict[str, Benchmark] = {
+	"get_num_val": (_expressions, lambda exprs: [get_num_val(e) for e in exprs]),
+	"var_planner": (_var_planner, _cycle_planner),
+	"emission": (lambda: None, lambda _: _big_program()),
+	"compute_output": (_big_program, lambda code: code.compute_output()),
+	"nodes": (lambda: None, _many_nodes),
+	# a fresh parser, as the one kept for the file would not parse anything again on the next runs
+	"front_end": (lambda: concept_source(3, 300), lambda source: (new_locator(), front.compile_source(source, parser=front.IncrementalParser()))),
+}
+
+@dataclass
+class Result:
+	seconds: float
+	peak_kib: float
+
+def measure(benchmark: Benchmark, repeat: int) -> Result:
+	"""returns the best time of repeat runs, and the peak memory of a run under tracemalloc"""
+
+	setup, run = benchmark
+	best = None
+
+	for _ in range(repeat):
+
+		state = setup()
+		start = time.perf_counter()
+		run(state)
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+
+	state = setup()
+	tracemalloc.start()
+
+	try:
+		run(state)
+		_, peak = tracemalloc.get_traced_memory()
+
+	finally:
+		tracemalloc.stop()
+
+	return Result(best, peak / 1024)
+
+def commit() -> str:
+
+	try:
+		return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+
+	except (OSError, subprocess.CalledProcessError):
+		return "?"
+
+def load_history(path: str) -> list[dict]:
+
+	try:
+		with open(path, encoding="utf-8") as file:
+			return json.load(file)
+
+	except FileNotFoundError:
+		return []
+
+def main():
+
+	parser = argparse.ArgumentParser(description="times the compiler on large synthetic programs")
+	parser.add_argument("names", nargs="*", help=f"benchmarks to run, among {', '.join(BENCHMARKS)}")
+	parser.add_argument("--repeat", type=int, default=3, help="runs of each benchmark, the best time is kept")
+	parser.add_argument("--history", default=HISTORY, help="JSON file the results are appended to")
+	parser.add_argument("--dry", action="store_true", help="don't record the results")
+	args = parser.parse_args()
+
+	history = load_history(args.history)
+	last = history[-1]["results"] if history else {}
+	results: dict[str, Result] = {}
+
+	for name in args.names or BENCHMARKS:
+
+		result = results[name] = measure(BENCHMARKS[name], args.repeat)
+		line = f"{name:<16}{result.seconds * 1000:>10.1f} ms{result.peak_kib:>12.0f} KiB"
+
+		if name in last:
+
+			ratio = result.seconds / last[name]["seconds"]
+			line += f"{ratio:>8.2f}x"
+
+			if ratio > REGRESSION:
+				line += " REGRESSION"
+
+		print(line)
+
+	if not args.dry:
+
+		history.append({
+			"commit": commit(),
+			"date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+			"results": {name: asdict(result) for name, result in results.items()},
+		})
+
+		with open(args.history, "w", encoding="utf-8") as file:
+			json.dump(history, file, indent="\t")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,2253 @@
+#encoding: utf-8
+
+from __future__ import annotations
+import re
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Any, Union
+
+import trans
+from abi import Abi
+from trans import (
+	Array, ArrayType, BinLogicOp, Const, CoreType, Else, FileContext, For, If, MedVar, Neg, Not, NumRaw, NumVal, Paren,
+	RefTypeUnit, Scope, SmallVar, String, StringConst, StringRaw, StructInstance, StructInstanceType, StructType,
+	Subprogram, TI_CONTEXT, Trait, TraitBoundType, VarPlanner, VarType, Vector, VectorType, While, get_fmt_type, get_fn_signature, wraw,
+)
+
+class ParseError(Exception): ...
+class TypeMismatch(Exception): ...
+class UnknownName(Exception): ...
+class Unsupported(Exception): ...
+
+# --- lexer ---
+
+@dataclass
+class Token:
+	kind: str
+	text: str
+	line: int
+	start: int
+	end: int
+
+_TOKEN = re.compile(r"""
+	(?P<space>\s+)
+	|(?P<comment>//[^\n]*|/\*.*?\*/)
+	|(?P<num>\d+(?:\.\d+)?)
+	|(?P<str>"[^"\n]*")
+	|(?P<name>[A-Za-z_][A-Za-z0-9_]*)
+	|(?P<op>::|->|==|!=|<=|>=|\+=|-=|\*=|/=|&&|\|\||[{}()\[\]<>,;:.=+\-*/&#!])
+""", re.S | re.X)
+
+BLOCK_ITEMS = ("struct", "impl", "trait", "fn", "if", "while", "for")
+
+def lex(source: str) -> list[Token]:
+
+	tokens: list[Token] = []
+	pos, line = 0, 0
+
+	while pos < len(source):
+
+		m = _TOKEN.match(source, pos)
+
+		if m is None:
+			raise ParseError(f"line {line + 1}: unexpected character {source[pos]!r}")
+
+		if m.lastgroup not in ("space", "comment"):
+			tokens.append(Token(m.lastgroup, m.group(), line, pos, m.end()))
+
+		line += m.group().count("\n")
+		pos = m.end()
+
+	tokens.append(Token("eof", "", line, pos, pos))
+	return tokens
+
+# --- syntax tree ---
+
+@dataclass
+class TypeName:
+	name: str
+	line: int
+
+@dataclass
+class RefTypeExpr:
+	inner: TypeExpr
+	borrowed: bool
+	line: int
+
+@dataclass
+class SeqTypeExpr:
+	item: TypeExpr
+	size: Expr
+	vector: bool
+	line: int
+
+TypeExpr = Union[TypeName, RefTypeExpr, SeqTypeExpr]
+
+@dataclass
+class NumLit:
+	text: str
+	line: int
+
+@dataclass
+class StrLit:
+	text: str
+	line: int
+
+@dataclass
+class BoolLit:
+	value: bool
+	line: int
+
+@dataclass
+class Name:
+	name: str
+	line: int
+
+@dataclass
+class SeqLit:
+	items: list[Expr]
+	vector: bool
+	line: int
+
+@dataclass
+class StructLit:
+	name: str
+	fields: list[tuple[str, Expr]]
+	line: int
+
+@dataclass
+class PathExpr:
+	owner: str
+	name: str
+	line: int
+
+@dataclass
+class CallExpr:
+	callee: Expr
+	args: list[Expr]
+	line: int
+
+@dataclass
+class MethodCall:
+	obj: Expr
+	name: str
+	args: list[Expr]
+	line: int
+
+@dataclass
+class FieldExpr:
+	obj: Expr
+	name: str
+	line: int
+
+@dataclass
+class IndexExpr:
+	obj: Expr
+	index: Expr
+	line: int
+
+@dataclass
+class Unary:
+	op: str
+	operand: Expr
+	line: int
+
+@dataclass
+class Binary:
+	op: str
+	a: Expr
+	b: Expr
+	line: int
+
+Expr = Union[NumLit, StrLit, BoolLit, Name, SeqLit, StructLit, PathExpr, CallExpr, MethodCall, FieldExpr, IndexExpr, Unary, Binary]
+
+@dataclass
+class Let:
+	name: str
+	type: TypeExpr or None
+	value: Expr or None
+	const: bool
+	line: int
+
+@dataclass
+class Assign:
+	target: Expr
+	op: str
+	value: Expr
+	line: int
+
+@dataclass
+class ExprStmt:
+	expr: Expr
+	line: int
+
+@dataclass
+class Block:
+	stmts: list[Stmt]
+	tail: Expr or None
+	line: int
+
+@dataclass
+class IfStmt:
+	cond: Expr
+	then: Block
+	orelse: Block or IfStmt or None
+	line: int
+
+@dataclass
+class WhileStmt:
+	cond: Expr
+	body: Block
+	line: int
+
+@dataclass
+class ForStmt:
+	var: str
+	args: list[Expr]
+	body: Block
+	line: int
+
+Stmt = Union[Let, Assign, ExprStmt, IfStmt, WhileStmt, ForStmt]
+
+@dataclass
+class StructDef:
+	name: str
+	fields: list[tuple[str, TypeExpr]]
+	line: int
+
+@dataclass
+class FnDef:
+	name: str
+	params: list[tuple[str, TypeExpr]]
+	ret: TypeExpr or None
+	body: Block or None
+	line: int
+
+@dataclass
+class ImplDef:
+	type_name: str
+	trait: str or None
+	fns: list[FnDef]
+	line: int
+
+@dataclass
+class TraitDef:
+	name: str
+	fns: list[FnDef]
+	line: int
+
+Node = Union[StructDef, FnDef, ImplDef, TraitDef, Stmt]
+
+@dataclass
+class Item:
+	"""a top level item, the lines of its node are relative to line"""
+	node: Node
+	line: int
+
+def children(node) -> list:
+	"""returns the nodes right under node"""
+
+	found = []
+
+	for value in vars(node).values():
+		for child in value if isinstance(value, list) else (value,):
+			for c in child if isinstance(child, tuple) else (child,):
+				if hasattr(c, "line"):
+					found.append(c)
+
+	return found
+
+def walk(node):
+	"""yields node and every node under it"""
+
+	yield node
+
+	for child in children(node):
+		yield from walk(child)
+
+def assigned_names(node) -> set[str]:
+	"""returns the names the code under node writes to or takes the address of"""
+
+	names = set()
+
+	for n in walk(node):
+
+		if isinstance(n, Assign) and isinstance(n.target, Name):
+			names.add(n.target.name)
+
+		elif isinstance(n, Assign) and isinstance(n.target, IndexExpr) and isinstance(n.target.obj, Name):
+			names.add(n.target.obj.name)
+
+		elif isinstance(n, Unary) and n.op in ("*", "&") and isinstance(n.operand, Name):
+			names.add(n.operand.name)
+
+	return names
+
+# --- parser ---
+
+class Parser:
+
+	def __init__(self, tokens: list[Token]):
+
+		self._tokens: list[Token] = tokens
+		self._pos: int = 0
+		# struct literals are not allowed where a block may follow, like in conditions
+		self._no_struct: bool = False
+
+	def peek(self, k: int = 0) -> Token:
+		return self._tokens[min(self._pos + k, len(self._tokens) - 1)]
+
+	def at(self, *texts: str, k: int = 0) -> bool:
+
+		t = self.peek(k)
+		return t.kind in ("op", "name") and t.text in texts
+
+	def take(self) -> Token:
+
+		t = self.peek()
+		self._pos += 1
+		return t
+
+	def error(self, msg: str) -> ParseError:
+
+		t = self.peek()
+		return ParseError(f"line {t.line + 1}: {msg}, found {t.text or 'end of file'!r}")
+
+	def expect(self, text: str) -> Token:
+
+		if not self.at(text):
+			raise self.error(f"expected {text!r}")
+
+		return self.take()
+
+	def expect_name(self) -> str:
+
+		if self.peek().kind != "name":
+			raise self.error("expected a name")
+
+		return self.take().text
+
+	def items(self) -> list[Node]:
+
+		items = []
+
+		while self.peek().kind != "eof":
+			items.append(self.item())
+
+		return items
+
+	def item(self) -> Node:
+
+		line = self.peek().line
+
+		if self.at("struct"):
+
+			self.take()
+			name = self.expect_name()
+			self.expect("{")
+			fields = self.separated("}", self.typed_name)
+			return StructDef(name, fields, line)
+
+		if self.at("impl"):
+
+			self.take()
+			first, trait = self.expect_name(), None
+
+			if self.at("for"):
+				self.take()
+				first, trait = self.expect_name(), first
+
+			self.expect("{")
+			fns = []
+
+			while not self.at("}"):
+				fns.append(self.fn())
+
+			self.take()
+			return ImplDef(first, trait, fns, line)
+
+		if self.at("trait"):
+
+			self.take()
+			name = self.expect_name()
+			self.expect("{")
+			fns = []
+
+			while not self.at("}"):
+				fns.append(self.fn(declaration=True))
+
+			self.take()
+			return TraitDef(name, fns, line)
+
+		if self.at("fn"):
+			return self.fn()
+
+		return self.statement()
+
+	def fn(self, declaration: bool = False) -> FnDef:
+
+		line = self.expect("fn").line
+		name = self.expect_name()
+		self.expect("(")
+		params = self.separated(")", self.typed_name)
+		ret = None
+
+		if self.at("->"):
+			self.take()
+			ret = self.type()
+
+		if declaration:
+			self.expect(";")
+			return FnDef(name, params, ret, None, line)
+
+		return FnDef(name, params, ret, self.block(), line)
+
+	def typed_name(self) -> tuple[str, TypeExpr]:
+
+		name = self.expect_name()
+		self.expect(":")
+		return name, self.type()
+
+	def separated(self, close: str, element) -> list:
+		"""parses comma separated elements up to close, a trailing comma is allowed"""
+
+		elements = []
+
+		while not self.at(close):
+
+			elements.append(element())
+
+			if not self.at(close):
+				self.expect(",")
+
+		self.take()
+		return elements
+
+	def type(self) -> TypeExpr:
+
+		line = self.peek().line
+
+		if self.at("*", "&"):
+			borrowed = self.take().text == "&"
+			t = RefTypeExpr(self.type(), borrowed, line)
+
+		else:
+			t = TypeName(self.expect_name(), line)
+
+		while self.at("[", "<"):
+
+			vector = self.take().text == "<"
+			size = self.postfix()
+			self.expect(">" if vector else "]")
+			t = SeqTypeExpr(t, size, vector, line)
+
+		return t
+
+	def block(self) -> Block:
+
+		line = self.expect("{").line
+		stmts, tail = [], None
+
+		while not self.at("}"):
+
+			if self.at("if", "while", "for", "const") or self.peek().kind == "name" and self.at(":", k=1):
+				stmts.append(self.statement())
+				continue
+
+			expr_line = self.peek().line
+			expr = self.expr()
+
+			if self.at("}"):
+				tail = expr
+
+			else:
+				stmts.append(self.simple_statement(expr, expr_line))
+
+		self.take()
+		return Block(stmts, tail, line)
+
+	def statement(self) -> Stmt:
+
+		line = self.peek().line
+
+		if self.at("if"):
+			return self.if_statement()
+
+		if self.at("while"):
+
+			self.take()
+			return WhileStmt(self.condition(), self.block(), line)
+
+		if self.at("for"):
+
+			self.take()
+			self.expect("(")
+			var = self.expect_name()
+			self.expect(",")
+			args = self.separated(")", self.expr)
+			return ForStmt(var, args, self.block(), line)
+
+		if self.at("const") or self.peek().kind == "name" and self.at(":", k=1):
+
+			const = self.at("const")
+			if const: self.take()
+			name, t = self.typed_name()
+			value = None
+
+			if self.at("="):
+				self.take()
+				value = self.expr()
+
+			self.expect(";")
+			return Let(name, t, value, const, line)
+
+		return self.simple_statement(self.expr(), line)
+
+	def simple_statement(self, expr: Expr, line: int) -> Stmt:
+
+		if self.at("=", "+=", "-=", "*=", "/="):
+
+			op = self.take().text
+			value = self.expr()
+			self.expect(";")
+			return Assign(expr, op, value, line)
+
+		self.expect(";")
+		return ExprStmt(expr, line)
+
+	def if_statement(self) -> IfStmt:
+
+		line = self.expect("if").line
+		cond = self.condition()
+		then = self.block()
+		orelse = None
+
+		if self.at("else"):
+			self.take()
+			orelse = self.if_statement() if self.at("if") else self.block()
+
+		return IfStmt(cond, then, orelse, line)
+
+	def condition(self) -> Expr:
+
+		self._no_struct = True
+		cond = self.expr()
+		self._no_struct = False
+		return cond
+
+	def expr(self) -> Expr:
+		return self.binary(0)
+
+	_LEVELS: tuple[tuple[str, ...], ...] = (("||",), ("&&",), ("==", "!=", "<", ">", "<=", ">="), ("+", "-"), ("*", "/"))
+
+	def binary(self, level: int) -> Expr:
+
+		if level == len(self._LEVELS):
+			return self.unary()
+
+		a = self.binary(level + 1)
+
+		while self.at(*self._LEVELS[level]):
+			t = self.take()
+			a = Binary(t.text, a, self.binary(level + 1), t.line)
+
+		return a
+
+	def unary(self) -> Expr:
+
+		if self.at("-", "!", "*", "#", "&"):
+			t = self.take()
+			return Unary(t.text, self.unary(), t.line)
+
+		return self.postfix()
+
+	def postfix(self) -> Expr:
+
+		e = self.primary()
+
+		while self.at(".", "(", "["):
+
+			t = self.take()
+
+			if t.text == ".":
+
+				name = self.expect_name()
+
+				if self.at("("):
+					self.take()
+					e = MethodCall(e, name, self.separated(")", self.expr), t.line)
+
+				else:
+					e = FieldExpr(e, name, t.line)
+
+			elif t.text == "(":
+				e = CallExpr(e, self.separated(")", self.expr), t.line)
+
+			else:
+				e = IndexExpr(e, self.expr(), t.line)
+				self.expect("]")
+
+		return e
+
+	def primary(self) -> Expr:
+
+		t = self.peek()
+
+		if t.kind == "num":
+			return NumLit(self.take().text, t.line)
+
+		if t.kind == "str":
+			return StrLit(self.take().text[1:-1], t.line)
+
+		if self.at("true", "false"):
+			return BoolLit(self.take().text == "true", t.line)
+
+		if self.at("("):
+
+			self.take()
+			no_struct, self._no_struct = self._no_struct, False
+			e = self.expr()
+			self._no_struct = no_struct
+			self.expect(")")
+			return e
+
+		if self.at("["):
+			self.take()
+			return SeqLit(self.separated("]", self.expr), False, t.line)
+
+		if self.at("<"):
+			# a vector literal, its items stop before comparisons so that > closes it
+			self.take()
+			return SeqLit(self.separated(">", lambda: self.binary(3)), True, t.line)
+
+		if t.kind == "name":
+
+			name = self.take().text
+
+			if self.at("::"):
+				self.take()
+				return PathExpr(name, self.expect_name(), t.line)
+
+			if self.at("{") and name[0].isupper() and not self._no_struct:
+				self.take()
+				return StructLit(name, self.separated("}", self.field_init), t.line)
+
+			return Name(name, t.line)
+
+		raise self.error("expected an expression")
+
+	def field_init(self) -> tuple[str, Expr]:
+
+		name = self.expect_name()
+		self.expect(":")
+		return name, self.expr()
+
+def parse(source: str) -> list[Item]:
+	return [Item(node, 0) for node in Parser(lex(source)).items()]
+
+def split_items(tokens: list[Token]) -> list[tuple[int, int]]:
+	"""returns the token ranges of the top level items"""
+
+	ranges = []
+	i = 0
+
+	while tokens[i].kind != "eof":
+
+		start, depth = i, 0
+		block_item = tokens[i].kind == "name" and tokens[i].text in BLOCK_ITEMS
+
+		while True:
+
+			t = tokens[i]
+
+			if t.kind == "eof":
+				raise ParseError(f"line {tokens[start].line + 1}: unterminated item")
+
+			if t.kind == "op" and t.text in "{([": depth += 1
+			elif t.kind == "op" and t.text in "})]": depth -= 1
+
+			i += 1
+
+			if depth == 0 and t.text == (";" if not block_item else "}") and t.kind == "op":
+				if not (block_item and tokens[i].text == "else"):
+					break
+
+		ranges.append((start, i))
+
+	return ranges
+
+class IncrementalParser:
+	"""parses a whole source but only re-parses the top level items whose text changed"""
+
+	def __init__(self):
+
+		self._cache: dict[str, Node] = {}
+		self.parsed: int = 0
+		self.reused: int = 0
+
+	def parse(self, source: str) -> list[Item]:
+
+		tokens = lex(source)
+		items, cache = [], {}
+		self.parsed = self.reused = 0
+
+		for start, end in split_items(tokens):
+
+			text = source[tokens[start].start:tokens[end - 1].end]
+			node = self._cache.get(text)
+
+			if node is None:
+
+				try:
+					node, = Parser(lex(text)).items()
+
+				except ParseError as err:
+					raise ParseError(f"{err} (in the item starting at line {tokens[start].line + 1})") from err
+
+				self.parsed += 1
+
+			else:
+				self.reused += 1
+
+			cache[text] = node
+			items.append(Item(node, tokens[start].line))
+
+		self._cache = cache
+		return items
+
+# --- types ---
+
+def core(core_type: CoreType, ref_type: tuple[RefTypeUnit, ...] = (RefTypeUnit.no_ref,), borrowed: bool = False) -> VarType:
+	return VarType(ref_type=ref_type, core_type=core_type, borrowed=borrowed)
+
+NUM = core(CoreType.num)
+LONG = core(CoreType.long)
+STRING = core(CoreType.string)
+UNIT = core(CoreType.unit)
+
+def is_number(t: VarType) -> bool:
+	return t.core_type in (CoreType.num, CoreType.long) and t.ref_type == (RefTypeUnit.no_ref,) and not t.borrowed
+
+def is_struct(t: VarType) -> bool:
+	return isinstance(t, StructInstanceType)
+
+def is_bound(t: VarType) -> bool:
+	return isinstance(t, TraitBoundType)
+
+def is_pointer(t: VarType) -> bool:
+	return not is_struct(t) and not is_bound(t) and (t.borrowed or t.ref_type[-1] != RefTypeUnit.no_ref)
+
+def pointee(t: VarType) -> VarType:
+
+	inner = t.clone()
+
+	if inner.borrowed: inner.borrowed = False
+	else: inner.ref_type = inner.ref_type[:-1]
+
+	return inner
+
+def same_type(a: VarType, b: VarType) -> bool:
+	"""tells if a value of type b can be stored where a is expected"""
+
+	if is_number(a) and is_number(b):
+		return True
+
+	if is_struct(a) and is_struct(b):
+		return a.struct_type == b.struct_type
+
+	# trait bounds are resolved statically, any implementing struct fits
+	if is_bound(a):
+		return is_struct(b) and a.trait.implemented_by(b.struct_type)
+
+	return get_fmt_type(a) == get_fmt_type(b)
+
+@dataclass
+class Typed:
+	value: Any
+	type: VarType
+	# set on struct instances nobody owns yet, like literals and call results
+	fresh: bool = False
+
+@dataclass
+class Symbol:
+	type: VarType
+	value: Any
+	const: bool = False
+	# the value a variable is known to hold at this point of the program, if any
+	known: Any = None
+
+class Env:
+
+	def __init__(self, parent: Env or None = None):
+
+		self._parent: Env or None = parent
+		self._symbols: dict[str, Symbol] = {}
+
+	def get(self, name: str) -> Symbol or None:
+
+		if name in self._symbols:
+			return self._symbols[name]
+
+		return self._parent.get(name) if self._parent is not None else None
+
+	def bind(self, name: str, symbol: Symbol):
+		self._symbols[name] = symbol
+
+@dataclass
+class Instance:
+	"""a calculator program implementing a function, with some parameters fixed to constants"""
+	program: str
+	abi: Abi
+	consts: dict[int, Const]
+	# strings cannot go through number registers, each string parameter has its own slot
+	strings: dict[str, String] = field(default_factory=dict)
+	ret_string: String or None = None
+
+	def matches(self, args: list[Typed]) -> bool:
+		return all(isinstance(args[i].value, Const) and args[i].value.val == c.val for i, c in self.consts.items())
+
+@dataclass
+class FnInfo:
+	name: str
+	node: FnDef
+	params: list[tuple[str, VarType]]
+	ret: VarType
+	owner: StructType or None = None
+	line: int = 0
+	# inlined functions have no program, their body is lowered at every call site
+	inline: bool = False
+	instances: list[Instance] = field(default_factory=list)
+
+	@property
+	def is_method(self) -> bool:
+		return bool(self.params) and self.params[0][0] == "self"
+
+BUILTINS = ("Disp", "panic")
+
+# bodies up to this many syntax tree nodes are inlined at every call site, a
+# program call costs the argument stores, the prgm line and reading Rep back
+INLINE_SIZE = 24
+MAX_SPECIALIZATIONS = 4
+
+# --- type checking and lowering ---
+
+class Compiler:
+	"""type checks the items and lowers them onto trans, one calculator program per function"""
+
+	def __init__(self, main: str = "MAIN", filename: str = "?"):
+
+		self._main: str = main
+		self._filename: str = filename
+		self._globals: Env = Env()
+		self._structs: dict[str, StructType] = {}
+		self._traits: dict[str, tuple[Trait, TraitDef]] = {}
+		self._fns: dict[str, FnInfo] = {}
+		self._programs: set[str] = set()
+		self._addressed: set[str] = set()
+		self._line: int = 0
+		self._self_type: StructType or None = None
+
+	def compile(self, items: list[Item]) -> dict[str, str]:
+		"""returns the source of every program, by program name"""
+
+		trans.new_locator()
+
+		for item in items:
+			self._addressed.update(self.addressed_names(item.node))
+
+		for item in items:
+			self.at(item.line)
+			self.declare(item.node)
+
+		self.plan(items)
+
+		for info in self._fns.values():
+			for instance in info.instances:
+				self.lower_fn(info, instance)
+
+		# the heap is set up once, by the main program
+		trans.init_mem()
+
+		for item in items:
+
+			if isinstance(item.node, (StructDef, FnDef, ImplDef, TraitDef)) or isinstance(item.node, Let) and item.node.const:
+				continue
+
+			self.at(item.line)
+			self.statement(item.node, self._globals)
+
+		outputs = {self._main: trans.Locator.target_code.compute_output()}
+		outputs.update((name, code.compute_output()) for name, code in trans.Locator.programs.items())
+		return outputs
+
+	def at(self, line: int):
+		"""sets the line of the item being lowered, node lines are relative to it"""
+
+		self._line = line
+		trans.Locator.set_file_context(FileContext(self._filename, line + 1))
+
+	def locate(self, node) -> str:
+		return f"{self._filename}@{self._line + node.line + 1}"
+
+	def addressed_names(self, node) -> set[str]:
+		"""returns the names whose address is taken, they have to live in ⌊RAM"""
+
+		return {n.operand.name for n in walk(node) if isinstance(n, Unary) and n.op in ("*", "&") and isinstance(n.operand, Name)}
+
+	# declarations
+
+	def declare(self, node: Node):
+
+		if isinstance(node, StructDef):
+
+			if node.name in self._structs:
+				raise TypeMismatch(f"{self.locate(node)}: struct {node.name} is defined twice")
+
+			self._structs[node.name] = StructType(node.name, ())
+			# members are resolved once every struct is known
+			members = tuple((name, self.resolve(t)) for name, t in node.fields)
+
+			for name, t in members:
+				if not (is_number(t) or is_pointer(t)):
+					raise Unsupported(f"{self.locate(node)}: member {node.name}.{name} is a {get_fmt_type(t)}, calculator lists only hold numbers")
+
+			self._structs[node.name].set_members(members)
+
+		elif isinstance(node, TraitDef):
+			self._traits[node.name] = (Trait(node.name, tuple(fn.name for fn in node.fns)), node)
+
+		elif isinstance(node, ImplDef):
+
+			owner = self.struct(node.type_name, node)
+			self._self_type = owner
+
+			for fn in node.fns:
+				self.declare_fn(fn, owner)
+
+			if node.trait is not None:
+				self.check_trait_impl(node, owner)
+
+			self._self_type = None
+
+		elif isinstance(node, FnDef):
+			self.declare_fn(node, None)
+
+		elif isinstance(node, Let) and node.const:
+			self.const(node, self._globals)
+
+	def declare_fn(self, node: FnDef, owner: StructType or None):
+
+		name = f"{owner.name}::{node.name}" if owner is not None else node.name
+
+		# methods are called by their bare name, whichever impl or trait they come from
+		if owner is not None and owner.method(node.name) is not None:
+			raise TypeMismatch(f"{self.locate(node)}: {owner.name} already has a method {node.name}, an impl or a trait cannot define it again")
+
+		if name in self._fns:
+			raise TypeMismatch(f"{self.locate(node)}: {name} is defined twice")
+
+		params = [(pname, self.resolve(t)) for pname, t in node.params]
+		ret = self.resolve(node.ret) if node.ret is not None else UNIT
+		info = FnInfo(name, node, params, ret, owner, self._line)
+		self._fns[name] = info
+
+		if owner is not None:
+			signature = get_fn_signature(name, ret, [t for _, t in params])
+			owner.bind_method(signature, info, node.name)
+
+	def check_trait_impl(self, node: ImplDef, owner: StructType):
+
+		if node.trait not in self._traits:
+			raise UnknownName(f"{self.locate(node)}: unknown trait {node.trait}")
+
+		trait, trait_def = self._traits[node.trait]
+		implemented = {fn.name: fn for fn in node.fns}
+
+		for decl in trait_def.fns:
+
+			if decl.name not in implemented:
+				raise TypeMismatch(f"{self.locate(node)}: {owner.name} does not implement {trait.name}::{decl.name}")
+
+			info = self._fns[f"{owner.name}::{decl.name}"]
+			params = [self.resolve(t) for _, t in decl.params]
+			ret = self.resolve(decl.ret) if decl.ret is not None else UNIT
+
+			# the receiver may be taken by value or borrowed
+			if len(params) != len(info.params) or not same_type(ret, info.ret) or not all(same_type(a, b) for a, (_, b) in zip(params, info.params)):
+				raise TypeMismatch(f"{self.locate(decl)}: {owner.name}::{decl.name} does not match its declaration in {trait.name}")
+
+		trait.implement(owner)
+
+	def program_name(self, name: str) -> str:
+
+		base = re.sub(r"[^A-Z0-9]", "", name.upper()).lstrip("0123456789") or "FN"
+		taken = self._programs | {self._main}
+		candidate, n = base[:8], 0
+
+		while candidate in taken or candidate.startswith("HN"):
+			n += 1
+			candidate = base[:8 - len(str(n))] + str(n)
+
+		return candidate
+
+	def struct(self, name: str, node) -> StructType:
+
+		if name == "Self" and self._self_type is not None:
+			return self._self_type
+
+		if name not in self._structs:
+			raise UnknownName(f"{self.locate(node)}: unknown struct {name}")
+
+		return self._structs[name]
+
+	def resolve(self, t: TypeExpr) -> VarType:
+
+		if isinstance(t, RefTypeExpr):
+
+			inner = self.resolve(t.inner)
+
+			if is_struct(inner) or is_bound(inner):
+				inner = inner.clone()
+				inner.borrowed = True
+				return inner
+
+			if t.borrowed:
+				return core(inner.core_type, inner.ref_type, True)
+
+			return core(inner.core_type, inner.ref_type + (RefTypeUnit.med_var,))
+
+		if isinstance(t, SeqTypeExpr):
+
+			item = self.resolve(t.item)
+
+			if not is_number(item):
+				raise Unsupported(f"{self.locate(t)}: sequences of {get_fmt_type(item)} are not supported")
+
+			if t.vector:
+				return VectorType(ref_type=(RefTypeUnit.no_ref,), core_type=CoreType.vector, borrowed=False, item=item)
+
+			size = self.expr(t.size, self._globals).value
+
+			if not isinstance(size, Const):
+				raise TypeMismatch(f"{self.locate(t)}: the size of an array must be known at compile time")
+
+			return ArrayType(ref_type=(RefTypeUnit.no_ref,), core_type=CoreType.array, borrowed=False, item=item, size=int(float(size.val)))
+
+		if t.name == "num": return NUM
+		if t.name == "long": return LONG
+		if t.name == "string": return STRING
+
+		if t.name in self._traits:
+			return TraitBoundType(ref_type=(RefTypeUnit.no_ref,), core_type=CoreType.trait_bound, borrowed=False, trait=self._traits[t.name][0])
+
+		st = self.struct(t.name, t)
+		return StructInstanceType(ref_type=(RefTypeUnit.no_ref,), core_type=CoreType.struct_instance, borrowed=False, struct_type=st)
+
+	def const(self, node: Let, env: Env):
+
+		t = self.resolve(node.type)
+		value = self.expr(node.value, env)
+		self.check(t, value, node)
+
+		if t.core_type == CoreType.string and isinstance(value.value, StringConst):
+			env.bind(node.name, Symbol(t, value.value, const=True))
+
+		elif is_number(t) and isinstance(value.value, Const):
+			env.bind(node.name, Symbol(t, value.value, const=True))
+
+		else:
+			raise TypeMismatch(f"{self.locate(node)}: {node.name} is not known at compile time")
+
+	# functions
+
+	def plan(self, items: list[Item]):
+		"""decides which functions are inlined, and which constant arguments get a program of their own"""
+
+		# function -> functions it calls, None standing for the main program
+		edges: dict[str or None, set[str]] = {}
+		sites: dict[str, list[list[Expr or None]]] = {name: [] for name in self._fns}
+
+		for caller, body, self_name in self.bodies(items):
+			for node in walk(body):
+				for callee, args in self.callees(node, self_name):
+					edges.setdefault(caller, set()).add(callee)
+					sites[callee].append(args)
+
+		for name, info in self._fns.items():
+
+			if name in self.reachable(name, edges):
+				self.at(info.line)
+				raise Unsupported(f"{self.locate(info.node)}: {name} is recursive, functions keep their variables in global registers")
+
+			size = sum(1 for _ in walk(info.node.body))
+			info.inline = bool(sites[name]) and (size <= INLINE_SIZE or len(sites[name]) == 1)
+
+			# functions taking trait bounds are monomorphized: inlined at every call site, each
+			# method call in their body then resolves against the concrete struct passed
+			if any(is_bound(t) for _, t in info.params):
+				info.inline = True
+
+			if info.inline:
+				continue
+
+			assigned = assigned_names(info.node.body)
+			fixable = [i for i, (pname, t) in enumerate(info.params) if is_number(t) and pname not in assigned]
+			patterns: dict[tuple[tuple[int, str], ...], int] = {}
+
+			for args in sites[name]:
+
+				pattern = tuple((i, c) for i in fixable if i < len(args) and (c := self.constant(args[i])) is not None)
+
+				if len(pattern) == len(info.params) and self.foldable(info, [Decimal(c) for _, c in pattern]):
+					continue
+
+				if pattern:
+					patterns[pattern] = patterns.get(pattern, 0) + 1
+
+			# the generic program is always there for the call sites no specialization matches
+			specializations = sorted(patterns, key=lambda p: -patterns[p])[:MAX_SPECIALIZATIONS]
+			info.instances = [self.instance(info, {})] + [self.instance(info, {i: Const(c) for i, c in p}) for p in specializations]
+
+	def foldable(self, info: FnInfo, args: list[Any]) -> bool:
+		"""tells if a call on these arguments will run at compile time"""
+
+		try:
+			Evaluator(self, self._const_env()).call(info, args)
+			return True
+
+		except Evaluator.NotConstant:
+			return False
+
+	def bodies(self, items: list[Item]):
+		"""yields the caller, the code and the type Self stands for of every function body and main item"""
+
+		for item in items:
+
+			if isinstance(item.node, FnDef):
+				yield item.node.name, item.node.body, None
+
+			elif isinstance(item.node, ImplDef):
+				for fn in item.node.fns:
+					yield f"{item.node.type_name}::{fn.name}", fn.body, item.node.type_name
+
+			elif not isinstance(item.node, (StructDef, TraitDef)):
+				yield None, item.node, None
+
+	def callees(self, node, self_name: str or None) -> list[tuple[str, list[Expr or None]]]:
+		"""returns the functions node may call, with the arguments it passes"""
+
+		if isinstance(node, CallExpr) and isinstance(node.callee, Name) and node.callee.name in self._fns:
+			return [(node.callee.name, node.args)]
+
+		if isinstance(node, CallExpr) and isinstance(node.callee, PathExpr):
+			owner = self_name if node.callee.owner == "Self" else node.callee.owner
+			name = f"{owner}::{node.callee.name}"
+			return [(name, node.args)] if name in self._fns else []
+
+		# the receiver type is only known while lowering, every method of that name may be called
+		if isinstance(node, MethodCall):
+			return [(name, [None] + node.args) for name, info in self._fns.items() if info.owner is not None and info.node.name == node.name]
+
+		return []
+
+	def reachable(self, name: str, edges: dict[str or None, set[str]]) -> set[str]:
+
+		seen, todo = set(), list(edges.get(name, ()))
+
+		while todo:
+
+			callee = todo.pop()
+
+			if callee not in seen:
+				seen.add(callee)
+				todo.extend(edges.get(callee, ()))
+
+		return seen
+
+	def constant(self, expr: Expr or None) -> str or None:
+		"""returns the value of a literal or global constant argument"""
+
+		if isinstance(expr, (NumLit, BoolLit)):
+			return self.expr(expr, self._globals).value.val
+
+		if isinstance(expr, Name) and (symbol := self._globals.get(expr.name)) is not None and symbol.const and isinstance(symbol.value, Const):
+			return symbol.value.val
+
+		return None
+
+	def instance(self, info: FnInfo, consts: dict[int, Const]) -> Instance:
+
+		program = self.program_name(info.name)
+		self._programs.add(program)
+		instance = Instance(program, Abi(program), consts)
+		trans.Locator.declare_abi(instance.abi)
+
+		for n, (pname, t) in enumerate(info.params):
+			if t.core_type == CoreType.string and n not in consts:
+				instance.strings[pname] = String()
+
+		if info.ret.core_type == CoreType.string:
+			instance.ret_string = String()
+
+		return instance
+
+	def lower_fn(self, info: FnInfo, instance: Instance):
+
+		planners = (trans.Locator.small_vars, trans.Locator.med_vars, trans.Locator.string_vars)
+		before = [p.touched() for p in planners]
+		self.at(info.line)
+		self._self_type = info.owner
+
+		with Subprogram(instance.program):
+
+			result = None
+
+			with Scope():
+
+				env = Env(self._const_env())
+				n = 0
+
+				for i, (pname, t) in enumerate(info.params):
+
+					if i in instance.consts:
+						env.bind(pname, Symbol(t, instance.consts[i], const=True))
+						continue
+
+					if t.core_type == CoreType.string:
+						env.bind(pname, Symbol(t, instance.strings[pname]))
+						continue
+
+					if is_struct(t):
+						handle = SmallVar()
+						handle.set(NumRaw(instance.abi.arg(n)))
+						env.bind(pname, Symbol(t, self.view(t.struct_type, handle)))
+
+					else:
+						var = self.new_num_var(pname, NumRaw(instance.abi.arg(n)))
+						env.bind(pname, Symbol(t, var))
+
+					n += 1
+
+				tail = self.block(info.node.body, env)
+				self.check_return(info, tail)
+
+				if info.ret.core_type == CoreType.string:
+					instance.ret_string.set(tail.value)
+
+				elif is_struct(info.ret):
+
+					if tail.fresh:
+						tail.value.disown()
+
+					result = NumRaw(tail.value.addr)
+
+				elif info.ret.core_type != CoreType.unit:
+					result = self.new_num_var(init=tail.value)
+
+			# the result is read last so that it is left in Ans
+			if result is not None:
+				wraw(result.val)
+
+		# the caller must not reuse any variable of the function
+		for planner, touched in zip(planners, before):
+			planner.reserve(planner.touched() - touched)
+
+		self._self_type = None
+
+	def _const_env(self) -> Env:
+		"""functions only see constants, never the variables of the main program"""
+
+		env = Env()
+
+		for name, symbol in self._globals._symbols.items():
+			if symbol.const:
+				env.bind(name, symbol)
+
+		return env
+
+	def check_return(self, info: FnInfo, tail: Typed):
+
+		# a function without a return type drops the value of its tail
+		if info.ret.core_type != CoreType.unit and not same_type(info.ret, tail.type):
+			raise TypeMismatch(f"{self.locate(info.node)}: {info.name} returns {get_fmt_type(tail.type)} instead of {get_fmt_type(info.ret)}")
+
+	def call_fn(self, info: FnInfo, args: list[Typed], node) -> Typed:
+
+		if len(args) != len(info.params):
+			raise TypeMismatch(f"{self.locate(node)}: {info.name} takes {len(info.params)} arguments, {len(args)} given")
+
+		for (_, t), arg in zip(info.params, args):
+			self.check(t, arg, node)
+
+		values = [self.constant_value(arg.value) for arg in args]
+
+		# a pure function of known arguments runs at compile time
+		if None not in values:
+
+			try:
+				return self.folded(Evaluator(self, self._const_env()).call(info, values), info.ret)
+
+			except Evaluator.NotConstant:
+				pass
+
+		if info.inline:
+			return self.inline_fn(info, args)
+
+		instance = max((instance for instance in info.instances if instance.matches(args)), key=lambda instance: len(instance.consts))
+		numbers = []
+
+		for i, ((pname, t), arg) in enumerate(zip(info.params, args)):
+
+			if i in instance.consts:
+				continue
+
+			if t.core_type == CoreType.string:
+				instance.strings[pname].set(arg.value)
+
+			elif is_struct(t):
+				numbers.append(NumRaw(arg.value.addr))
+
+			else:
+				numbers.append(arg.value)
+
+		if is_struct(info.ret):
+
+			handle = SmallVar()
+			trans.call(instance.program, handle, *numbers)
+			return Typed(self.view(info.ret.struct_type, handle, owned=True), info.ret, fresh=True)
+
+		if info.ret.core_type == CoreType.string:
+			trans.call(instance.program, None, *numbers)
+			return Typed(StringRaw(instance.ret_string.val), STRING)
+
+		if info.ret.core_type == CoreType.unit:
+			trans.call(instance.program, None, *numbers)
+			return Typed(None, UNIT)
+
+		ret = self.new_num_var()
+		trans.call(instance.program, ret, *numbers)
+		return Typed(ret, info.ret)
+
+	def inline_fn(self, info: FnInfo, args: list[Typed]) -> Typed:
+		"""lowers the body of info in place, constant arguments fold into it"""
+
+		line, self_type = self._line, self._self_type
+		self.at(info.line)
+		self._self_type = info.owner
+
+		body = info.node.body
+		copied = assigned_names(body)
+		# without statements nor calls nothing can change an argument while the body runs
+		pure = not body.stmts and not any(isinstance(n, (CallExpr, MethodCall)) for n in walk(body))
+		env = Env(self._const_env())
+
+		if pure:
+
+			for (pname, t), arg in zip(info.params, args):
+				env.bind(pname, Symbol(self.concrete(t, arg), self.param_value(body, pname, t, arg, pname in copied, pure)))
+
+			tail = self.block(body, env)
+			self.check_return(info, tail)
+			result = tail if info.ret.core_type != CoreType.unit else Typed(None, UNIT)
+
+		else:
+
+			# the result outlives the variables of the body
+			if is_struct(info.ret): holder = SmallVar()
+			elif info.ret.core_type == CoreType.string: holder = String()
+			elif info.ret.core_type != CoreType.unit: holder = self.new_num_var()
+			else: holder = None
+
+			with Scope():
+
+				for (pname, t), arg in zip(info.params, args):
+					env.bind(pname, Symbol(self.concrete(t, arg), self.param_value(body, pname, t, arg, pname in copied, pure)))
+
+				tail = self.block(body, env)
+				self.check_return(info, tail)
+
+				if is_struct(info.ret):
+
+					if tail.fresh:
+						tail.value.disown()
+
+					holder.set(NumRaw(tail.value.addr))
+
+				elif holder is not None:
+					holder.set(tail.value)
+
+			if is_struct(info.ret):
+				result = Typed(self.view(info.ret.struct_type, holder, owned=tail.fresh), info.ret, fresh=tail.fresh)
+
+			else:
+				result = Typed(holder, info.ret)
+
+		self.at(line)
+		self._self_type = self_type
+		return result
+
+	def concrete(self, t: VarType, arg: Typed) -> VarType:
+		"""returns the type a parameter has in an inlined body, trait bounds become the struct passed"""
+
+		if not is_bound(t):
+			return t
+
+		concrete = arg.type.clone()
+		concrete.borrowed = t.borrowed
+		return concrete
+
+	def param_value(self, body: Block, pname: str, t: VarType, arg: Typed, copied: bool, pure: bool):
+		"""returns what an inlined body sees as its parameter pname, the argument itself when it is safe"""
+
+		# struct instances are passed by handle anyway
+		if is_struct(t) or is_bound(t):
+			return arg.value
+
+		if t.core_type == CoreType.string:
+
+			if not copied:
+				return arg.value
+
+			string = String()
+			string.set(arg.value)
+			return string
+
+		uses = sum(1 for n in walk(body) if isinstance(n, Name) and n.name == pname)
+
+		# letters cannot be pointed to, a pure body substitutes its arguments
+		if not copied and (isinstance(arg.value, (Const, SmallVar)) or pure and (isinstance(arg.value, trans.Var) or uses <= 1)):
+			return arg.value
+
+		return self.new_num_var(pname, arg.value)
+
+	def constant_value(self, value) -> Any:
+		"""returns the value of a number or string known at compile time, None otherwise"""
+
+		if isinstance(value, StringConst):
+			return value.val[1:-1]
+
+		if isinstance(value, (trans.NumOp, Const)):
+			return trans.number(trans.ExprRoot(value).simplified_root())
+
+		return None
+
+	def number_val(self, value: Decimal) -> NumVal:
+		"""returns a calculator literal for value, ᴇ notation is not folded further so it is refused"""
+
+		if value != 0 and not Decimal("1e-6") <= abs(value) < Decimal("1e12"):
+			raise Evaluator.NotConstant(value)
+
+		if value == value.to_integral_value():
+			const = Const(int(abs(value)))
+			return Neg(const) if value < 0 else const
+
+		return trans.number_const(value)
+
+	def folded(self, value: Any, t: VarType) -> Typed:
+
+		if value is None:
+			return Typed(None, UNIT)
+
+		if isinstance(value, str):
+			return Typed(StringConst(value), STRING)
+
+		return Typed(self.number_val(value), t)
+
+	def fold(self, stmt: Stmt, env: Env) -> bool:
+		"""runs stmt at compile time and only emits the values it leaves, tells if it could"""
+
+		evaluator = Evaluator(self, env)
+
+		try:
+
+			evaluator.statement(stmt, [{}])
+			stores = []
+
+			for symbol, value in evaluator.writes.values():
+
+				if isinstance(symbol.value, Array):
+					stores.extend((symbol.value[Const(n)], self.number_val(v)) for n, v in enumerate(value) if v != symbol.known[n])
+
+				else:
+					stores.append((symbol.value, self.number_val(value)))
+
+		except Evaluator.NotConstant:
+			return False
+
+		if len(stores) > FOLD_STORES:
+			return False
+
+		for var, value in stores:
+			var.set(value)
+
+		for symbol, value in evaluator.writes.values():
+			symbol.known = value
+
+		return True
+
+	def forget(self, node, env: Env):
+		"""drops what is known of the variables written under node"""
+
+		for name in assigned_names(node):
+			if (symbol := env.get(name)) is not None:
+				symbol.known = None
+
+	def view(self, st: StructType, handle: SmallVar, owned: bool = False) -> StructInstance:
+		return StructInstance(tuple((name, Const(0)) for name, _ in st.members), addr=handle, owned=owned)
+
+	def new_num_var(self, name: str or None = None, init: NumVal or None = None) -> SmallVar or MedVar:
+		"""returns a letter when one is left, a ⌊RAM slot for variables whose address is taken,
+		set to init with a single store (⌊RAM slots are cleared without one)"""
+
+		text = trans.get_num_val(init) if init is not None else None
+
+		if name is not None and name in self._addressed:
+			return MedVar(text or "0")
+
+		try:
+			return SmallVar(text)
+
+		except VarPlanner.CannotGet:
+			return MedVar(text or "0")
+
+	# statements
+
+	def check(self, expected: VarType, value: Typed, node):
+
+		if not same_type(expected, value.type):
+			raise TypeMismatch(f"{self.locate(node)}: expected {get_fmt_type(expected)}, found {get_fmt_type(value.type)}")
+
+	def block(self, block: Block, env: Env) -> Typed:
+		"""lowers the statements of a block, returns the value of its tail"""
+
+		for stmt in block.stmts:
+			self.statement(stmt, env)
+
+		if block.tail is None:
+			return Typed(None, UNIT)
+
+		return self.expr(block.tail, env)
+
+	def statement(self, stmt: Stmt, env: Env):
+
+		if isinstance(stmt, Let):
+
+			if stmt.const: self.const(stmt, env)
+			else: self.let(stmt, env)
+
+		elif isinstance(stmt, Assign):
+			self.assign(stmt, env)
+
+		elif isinstance(stmt, ExprStmt):
+			self.expr(stmt.expr, env)
+
+		elif isinstance(stmt, (IfStmt, WhileStmt, ForStmt)) and self.fold(stmt, env):
+			return
+
+		elif isinstance(stmt, IfStmt):
+
+			# what a branch learns holds neither in the other branch nor after the block
+			self.forget(stmt, env)
+
+			with If(self.condition(stmt.cond, env)):
+
+				self.block(stmt.then, Env(env))
+
+				if stmt.orelse is not None:
+
+					Else()
+					self.forget(stmt, env)
+
+					if isinstance(stmt.orelse, IfStmt): self.statement(stmt.orelse, Env(env))
+					else: self.block(stmt.orelse, Env(env))
+
+			self.forget(stmt, env)
+
+		elif isinstance(stmt, WhileStmt):
+
+			self.forget(stmt, env)
+
+			with While(self.condition(stmt.cond, env)):
+				self.block(stmt.body, Env(env))
+
+			self.forget(stmt, env)
+
+		elif isinstance(stmt, ForStmt):
+
+			self.forget(stmt, env)
+			self.for_loop(stmt, env)
+			self.forget(stmt, env)
+
+		else:
+			raise Unsupported(f"{self.locate(stmt)}: {type(stmt).__name__} is not a statement")
+
+	def condition(self, expr: Expr, env: Env) -> NumVal:
+
+		cond = self.expr(expr, env)
+
+		if not is_number(cond.type):
+			raise TypeMismatch(f"{self.locate(expr)}: a condition must be a number, found {get_fmt_type(cond.type)}")
+
+		return cond.value
+
+	def for_loop(self, stmt: ForStmt, env: Env):
+
+		args = stmt.args
+
+		if len(args) == 1 and isinstance(args[0], CallExpr) and isinstance(args[0].callee, Name) and args[0].callee.name in ("Range", "Amount"):
+
+			if len(args[0].args) != 1:
+				raise TypeMismatch(f"{self.locate(stmt)}: {args[0].callee.name} takes one argument")
+
+			n = self.number(args[0].args[0], env)
+			bounds = trans.Range(n) if args[0].callee.name == "Range" else trans.Amount(n)
+
+		elif len(args) in (2, 3):
+			bounds = tuple(self.number(arg, env) for arg in args)
+
+		else:
+			raise TypeMismatch(f"{self.locate(stmt)}: a for loop takes a start, an end and a step, or a Range or an Amount")
+
+		with For(..., *bounds) as fl:
+
+			body_env = Env(env)
+
+			if stmt.var != "_":
+				body_env.bind(stmt.var, Symbol(NUM, fl.var))
+
+			self.block(stmt.body, body_env)
+
+	def number(self, expr: Expr, env: Env) -> NumVal:
+
+		value = self.expr(expr, env)
+
+		if not is_number(value.type):
+			raise TypeMismatch(f"{self.locate(expr)}: expected a number, found {get_fmt_type(value.type)}")
+
+		return value.value
+
+	def let(self, stmt: Let, env: Env):
+
+		value = self.expr(stmt.value, env) if stmt.value is not None and not isinstance(stmt.value, SeqLit) else None
+		t = self.resolve(stmt.type) if stmt.type is not None else value.type
+		symbol = Symbol(t, self.storage(stmt, t, value, env))
+
+		# letters are not cleared when declared, and variables whose address is taken may change behind our back
+		if stmt.name not in self._addressed and (stmt.value is not None or isinstance(symbol.value, (MedVar, Array))):
+
+			try:
+				symbol.known = Evaluator(self, env).initial(stmt, [{}])
+
+			except Evaluator.NotConstant:
+				pass
+
+		env.bind(stmt.name, symbol)
+
+	def storage(self, stmt: Let, t: VarType, value: Typed or None, env: Env):
+		"""allocates a variable of type t, initialised from the declaration"""
+
+		if value is not None:
+			self.check(t, value, stmt)
+
+		if isinstance(t, ArrayType):
+
+			items = self.seq_items(stmt, t.size, env) if stmt.value is not None else []
+			# a literal filling the whole array makes zeroing it first useless
+			array = Array(Const(t.size), _init=len(items) < t.size)
+
+			for n, item in enumerate(items):
+				array[Const(n)].set(item)
+
+			return array
+
+		if isinstance(t, VectorType):
+
+			size = self.number(stmt.type.size, env) if stmt.type is not None else Const(0)
+			vector = Vector(size)
+
+			if stmt.value is not None:
+				vector.init(self.seq_items(stmt, None, env))
+
+			return vector
+
+		if is_struct(t):
+
+			if value is None:
+				return StructInstance(tuple((name, Const(0)) for name, _ in t.struct_type.members))
+
+			return value.value if value.fresh else value.value.clone()
+
+		if t.core_type == CoreType.string:
+
+			string = String()
+			if value is not None: string.set(value.value)
+			return string
+
+		init = value.value if value is not None else None
+
+		if t.core_type == CoreType.long:
+			return MedVar(trans.get_num_val(init) if init is not None else "0")
+
+		return self.new_num_var(stmt.name, init)
+
+	def seq_items(self, stmt: Let, size: int or None, env: Env) -> list[NumVal]:
+
+		if not isinstance(stmt.value, SeqLit):
+			raise Unsupported(f"{self.locate(stmt)}: sequences can only be initialised with a literal")
+
+		if size is not None and len(stmt.value.items) > size:
+			raise TypeMismatch(f"{self.locate(stmt)}: {len(stmt.value.items)} items do not fit in {size}")
+
+		return [self.number(item, env) for item in stmt.value.items]
+
+	def assign(self, stmt: Assign, env: Env):
+
+		if isinstance(stmt.target, Name) and env.get(stmt.target.name) is None:
+
+			if stmt.op != "=":
+				raise UnknownName(f"{self.locate(stmt)}: unknown variable {stmt.target.name}")
+
+			self.let(Let(stmt.target.name, None, stmt.value, False, stmt.line), env)
+			return
+
+		if isinstance(stmt.target, Name) and env.get(stmt.target.name).const:
+			raise TypeMismatch(f"{self.locate(stmt)}: cannot assign to the constant {stmt.target.name}")
+
+		# what the assignment leaves is worked out before the variables it reads change
+		evaluator = Evaluator(self, env)
+
+		try:
+			evaluator.statement(stmt, [{}])
+			learnt = list(evaluator.writes.values())
+
+		except Evaluator.NotConstant:
+			learnt = None
+
+		target = self.expr(stmt.target, env)
+		value = self.expr(stmt.value, env) if stmt.op == "=" else self.binary(Binary(stmt.op[0], stmt.target, stmt.value, stmt.line), env)
+		self.check(target.type, value, stmt)
+
+		if is_struct(target.type):
+
+			for name, _ in target.type.struct_type.members:
+				target.value.get_member(name).set(value.value.get_member(name))
+
+		elif target.type.core_type == CoreType.string:
+			target.value.set(value.value)
+
+		elif isinstance(target.value, (SmallVar, MedVar, trans.StructMember, trans.RamAccess)):
+			target.value.set(value.value)
+
+		else:
+			raise TypeMismatch(f"{self.locate(stmt)}: cannot assign to this expression")
+
+		if learnt is None:
+			self.forget(stmt, env)
+
+		for symbol, known in learnt or ():
+			symbol.known = known
+
+	# expressions
+
+	def expr(self, expr: Expr, env: Env) -> Typed:
+
+		if isinstance(expr, NumLit):
+			return Typed(Const(int(float(expr.text)) if float(expr.text).is_integer() else expr.text), NUM)
+
+		if isinstance(expr, StrLit):
+			return Typed(StringConst(expr.text), STRING)
+
+		if isinstance(expr, BoolLit):
+			return Typed(trans.true if expr.value else trans.false, NUM)
+
+		if isinstance(expr, Name):
+
+			symbol = env.get(expr.name)
+
+			if symbol is None:
+				raise UnknownName(f"{self.locate(expr)}: unknown name {expr.name}")
+
+			return Typed(symbol.value, symbol.type)
+
+		if isinstance(expr, Unary):
+			return self.unary(expr, env)
+
+		if isinstance(expr, Binary):
+			return self.binary(expr, env)
+
+		if isinstance(expr, StructLit):
+
+			st = self.struct(expr.name, expr)
+			given = dict(expr.fields)
+			members = []
+
+			for name, t in st.members:
+
+				if name not in given:
+					raise TypeMismatch(f"{self.locate(expr)}: missing member {st.name}.{name}")
+
+				value = self.expr(given.pop(name), env)
+				self.check(t, value, expr)
+				members.append((name, value.value))
+
+			if given:
+				raise TypeMismatch(f"{self.locate(expr)}: {st.name} has no member {', '.join(given)}")
+
+			t = StructInstanceType(ref_type=(RefTypeUnit.no_ref,), core_type=CoreType.struct_instance, borrowed=False, struct_type=st)
+			return Typed(StructInstance(tuple(members)), t, fresh=True)
+
+		if isinstance(expr, FieldExpr):
+
+			obj = self.expr(expr.obj, env)
+
+			if not is_struct(obj.type):
+				raise TypeMismatch(f"{self.locate(expr)}: {get_fmt_type(obj.type)} has no members")
+
+			for name, t in obj.type.struct_type.members:
+				if name == expr.name:
+					return Typed(obj.value.get_member(name), t)
+
+			raise TypeMismatch(f"{self.locate(expr)}: {obj.type.struct_type.name} has no member {expr.name}")
+
+		if isinstance(expr, IndexExpr):
+
+			obj = self.expr(expr.obj, env)
+			index = self.number(expr.index, env)
+
+			if not isinstance(obj.type, (ArrayType, VectorType)):
+				raise TypeMismatch(f"{self.locate(expr)}: {get_fmt_type(obj.type)} cannot be indexed")
+
+			return Typed(obj.value[index], obj.type.item)
+
+		if isinstance(expr, CallExpr):
+			return self.call(expr, env)
+
+		if isinstance(expr, MethodCall):
+			return self.method_call(expr, env)
+
+		if isinstance(expr, SeqLit):
+			raise Unsupported(f"{self.locate(expr)}: sequence literals can only initialise a declaration")
+
+		raise Unsupported(f"{self.locate(expr)}: {type(expr).__name__} is not an expression")
+
+	def unary(self, expr: Unary, env: Env) -> Typed:
+
+		operand = self.expr(expr.operand, env)
+		t = operand.type
+
+		if expr.op in ("*", "&"):
+
+			if is_struct(t):
+				borrowed = t.clone()
+				borrowed.borrowed = True
+				return Typed(operand.value, borrowed)
+
+			if not isinstance(operand.value, MedVar):
+				raise TypeMismatch(f"{self.locate(expr)}: only variables have an address")
+
+			if expr.op == "&":
+				return Typed(Const(operand.value.addr), core(t.core_type, t.ref_type, True))
+
+			return Typed(Const(operand.value.addr), core(t.core_type, t.ref_type + (RefTypeUnit.med_var,)))
+
+		if expr.op == "#":
+
+			if not is_pointer(t):
+				raise TypeMismatch(f"{self.locate(expr)}: cannot dereference a {get_fmt_type(t)}")
+
+			inner = pointee(t)
+			return Typed(MedVar(addr=trans.get_num_val(operand.value), ref_type=inner.ref_type), inner)
+
+		if not is_number(t):
+			raise TypeMismatch(f"{self.locate(expr)}: cannot apply {expr.op} to a {get_fmt_type(t)}")
+
+		return Typed(Neg(operand.value) if expr.op == "-" else Not(operand.value), NUM)
+
+	_COMPARISONS = {"==": "=", "!=": "≠", "<": "<", ">": ">", "<=": "≤", ">=": "≥", "&&": " et ", "||": " ou "}
+
+	def binary(self, expr: Binary, env: Env) -> Typed:
+
+		a, b = self.expr(expr.a, env), self.expr(expr.b, env)
+
+		if expr.op == "+" and a.type.core_type == CoreType.string and b.type.core_type == CoreType.string:
+			return Typed(StringRaw(f"{a.value.val}+{b.value.val}"), STRING)
+
+		if not is_number(a.type) or not is_number(b.type):
+			raise TypeMismatch(f"{self.locate(expr)}: cannot apply {expr.op} to {get_fmt_type(a.type)} and {get_fmt_type(b.type)}")
+
+		t = LONG if LONG in (a.type, b.type) else NUM
+
+		if expr.op in self._COMPARISONS:
+			return Typed(Paren(BinLogicOp(self._COMPARISONS[expr.op], a.value, b.value)), NUM)
+
+		if expr.op == "+": return Typed(a.value + b.value, t)
+		if expr.op == "-": return Typed(a.value - b.value, t)
+		if expr.op == "*": return Typed(a.value * b.value, t)
+		return Typed(a.value / b.value, t)
+
+	def call(self, expr: CallExpr, env: Env) -> Typed:
+
+		if isinstance(expr.callee, PathExpr):
+
+			st = self.struct(expr.callee.owner, expr.callee)
+			info = self._fns.get(f"{st.name}::{expr.callee.name}")
+
+			if info is None:
+				raise UnknownName(f"{self.locate(expr)}: {st.name} has no function {expr.callee.name}")
+
+			return self.call_fn(info, [self.expr(arg, env) for arg in expr.args], expr)
+
+		if not isinstance(expr.callee, Name):
+			raise Unsupported(f"{self.locate(expr)}: only named functions can be called")
+
+		name = expr.callee.name
+		args = [self.expr(arg, env) for arg in expr.args]
+
+		if name in BUILTINS:
+
+			if len(args) != 1 or args[0].type.core_type == CoreType.unit:
+				raise TypeMismatch(f"{self.locate(expr)}: {name} takes one value")
+
+			if name == "Disp": trans.Disp(args[0].value)
+			else: trans.panic(args[0].value)
+
+			return Typed(None, UNIT)
+
+		if name not in self._fns:
+			raise UnknownName(f"{self.locate(expr)}: unknown function {name}")
+
+		return self.call_fn(self._fns[name], args, expr)
+
+	def method_call(self, expr: MethodCall, env: Env) -> Typed:
+
+		obj = self.expr(expr.obj, env)
+		args = [self.expr(arg, env) for arg in expr.args]
+
+		if isinstance(obj.type, VectorType):
+
+			if expr.name == "push" and len(args) == 1:
+				self.check(obj.type.item, args[0], expr)
+				obj.value.push(args[0].value)
+				return Typed(None, UNIT)
+
+			if expr.name == "pop" and not args:
+				return Typed(obj.value.pop(), obj.type.item)
+
+			raise UnknownName(f"{self.locate(expr)}: vectors have push(item) and pop() only")
+
+		if not is_struct(obj.type):
+			raise TypeMismatch(f"{self.locate(expr)}: {get_fmt_type(obj.type)} has no methods")
+
+		st = obj.type.struct_type
+		info = st.method(expr.name)
+
+		if info is None:
+			raise UnknownName(f"{self.locate(expr)}: {st.name} has no method {expr.name}")
+
+		if not info.is_method:
+			raise TypeMismatch(f"{self.locate(expr)}: {info.name} is called as {st.name}::{expr.name}(...)")
+
+		return self.call_fn(info, [obj] + args, expr)
+
+# --- partial evaluation ---
+
+# compile time evaluation gives up after this many steps, and when a folded
+# statement would need more stores than running it on the calculator
+FOLD_STEPS = 10000
+FOLD_STORES = 128
+
+class Evaluator:
+	"""runs pure code at compile time, on numbers, strings and arrays of numbers known in advance"""
+
+	class NotConstant(Exception): ...
+
+	def __init__(self, compiler: Compiler, env: Env, steps: int = FOLD_STEPS):
+
+		self._compiler: Compiler = compiler
+		self._env: Env = env
+		self._steps: int = steps
+		# writes to variables living outside the evaluated code, by symbol id
+		self.writes: dict[int, tuple[Symbol, Any]] = {}
+
+	def tick(self):
+
+		self._steps -= 1
+
+		if self._steps < 0:
+			raise self.NotConstant("too long to run at compile time")
+
+	def lookup(self, name: str, frames: list[dict[str, Any]]) -> Any:
+
+		for frame in reversed(frames):
+			if name in frame:
+				return frame[name]
+
+		symbol = self._env.get(name)
+
+		if symbol is None:
+			raise self.NotConstant(name)
+
+		if id(symbol) in self.writes:
+			return self.writes[id(symbol)][1]
+
+		if symbol.const and isinstance(symbol.value, StringConst):
+			return symbol.value.val[1:-1]
+
+		if symbol.const:
+
+			if (value := trans.number(symbol.value)) is None:
+				raise self.NotConstant(name)
+
+			return value
+
+		if symbol.known is None:
+			raise self.NotConstant(name)
+
+		return symbol.known
+
+	def store(self, name: str, value: Any, frames: list[dict[str, Any]]):
+		"""writes a variable, a value of another type than the variable is left for the compiler to report"""
+
+		for frame in reversed(frames):
+			if name in frame:
+
+				if type(value) is not type(frame[name]):
+					raise self.NotConstant(name)
+
+				frame[name] = value
+				return
+
+		symbol = self._env.get(name)
+
+		if symbol is None or symbol.const or not isinstance(symbol.value, (SmallVar, MedVar, Array)) or name in self._compiler._addressed:
+			raise self.NotConstant(name)
+
+		if not isinstance(value, list if isinstance(symbol.value, Array) else Decimal):
+			raise self.NotConstant(name)
+
+		self.writes[id(symbol)] = (symbol, value)
+
+	def number(self, value: Any) -> Decimal:
+
+		if not isinstance(value, Decimal):
+			raise self.NotConstant(value)
+
+		return value
+
+	def block(self, block: Block, frames: list[dict[str, Any]]) -> Any:
+
+		frames = frames + [{}]
+
+		for stmt in block.stmts:
+			self.statement(stmt, frames)
+
+		return self.expr(block.tail, frames) if block.tail is not None else None
+
+	def statement(self, stmt: Stmt, frames: list[dict[str, Any]]):
+
+		self.tick()
+
+		if isinstance(stmt, Let):
+			frames[-1][stmt.name] = self.initial(stmt, frames)
+
+		elif isinstance(stmt, Assign):
+
+			value = self.expr(stmt.value, frames)
+
+			if stmt.op != "=":
+				value = self.binary(stmt.op[0], self.expr(stmt.target, frames), value)
+
+			if isinstance(stmt.target, Name):
+				self.store(stmt.target.name, value, frames)
+
+			elif isinstance(stmt.target, IndexExpr) and isinstance(stmt.target.obj, Name):
+
+				items = list(self.lookup(stmt.target.obj.name, frames))
+				items[self.index(items, stmt.target.index, frames)] = self.number(value)
+				self.store(stmt.target.obj.name, items, frames)
+
+			else:
+				raise self.NotConstant(stmt)
+
+		elif isinstance(stmt, ExprStmt):
+			self.expr(stmt.expr, frames)
+
+		elif isinstance(stmt, IfStmt):
+
+			if self.number(self.expr(stmt.cond, frames)):
+				self.block(stmt.then, frames)
+
+			elif isinstance(stmt.orelse, IfStmt):
+				self.statement(stmt.orelse, frames)
+
+			elif stmt.orelse is not None:
+				self.block(stmt.orelse, frames)
+
+		elif isinstance(stmt, WhileStmt):
+
+			while self.number(self.expr(stmt.cond, frames)):
+				self.block(stmt.body, frames)
+
+		elif isinstance(stmt, ForStmt):
+			self.for_loop(stmt, frames)
+
+		else:
+			raise self.NotConstant(stmt)
+
+	def initial(self, stmt: Let, frames: list[dict[str, Any]]) -> Any:
+		"""returns the value a declaration starts with"""
+
+		if isinstance(stmt.type, SeqTypeExpr) and not stmt.type.vector and isinstance(stmt.type.item, TypeName) and stmt.type.item.name == "num":
+
+			items = [Decimal(0)] * int(self.number(self.expr(stmt.type.size, frames)))
+			given = stmt.value.items if isinstance(stmt.value, SeqLit) and not stmt.value.vector else [] if stmt.value is None else None
+
+			if given is None or len(given) > len(items):
+				raise self.NotConstant(stmt)
+
+			for n, item in enumerate(given):
+				items[n] = self.number(self.expr(item, frames))
+
+			return items
+
+		if stmt.type is not None and not (isinstance(stmt.type, TypeName) and stmt.type.name in ("num", "long", "string")):
+			raise self.NotConstant(stmt)
+
+		if stmt.value is None:
+			return "" if stmt.type.name == "string" else Decimal(0)
+
+		value = self.expr(stmt.value, frames)
+
+		if stmt.type is not None and isinstance(value, str) != (stmt.type.name == "string"):
+			raise self.NotConstant(stmt)
+
+		return value
+
+	def for_loop(self, stmt: ForStmt, frames: list[dict[str, Any]]):
+
+		args = stmt.args
+
+		if len(args) == 1 and isinstance(args[0], CallExpr) and isinstance(args[0].callee, Name) and args[0].callee.name in ("Range", "Amount") and len(args[0].args) == 1:
+			n = self.number(self.expr(args[0].args[0], frames))
+			start, end, step = (Decimal(0), n - 1, Decimal(1)) if args[0].callee.name == "Range" else (Decimal(1), n, Decimal(1))
+
+		elif len(args) in (2, 3):
+			start, end, step = (self.number(self.expr(arg, frames)) for arg in (*args, NumLit("1", 0))[:3])
+
+		else:
+			raise self.NotConstant(stmt)
+
+		if step == 0:
+			raise self.NotConstant(stmt)
+
+		# like For( on the calculator: the body may change the loop variable
+		frame = {stmt.var: start}
+
+		while frame[stmt.var] <= end if step > 0 else frame[stmt.var] >= end:
+			self.tick()
+			self.block(stmt.body, frames + [frame])
+			frame[stmt.var] = TI_CONTEXT.add(frame[stmt.var], step)
+
+	def index(self, items: list[Decimal], index: Expr, frames: list[dict[str, Any]]) -> int:
+
+		i = self.number(self.expr(index, frames))
+
+		if i != i.to_integral_value() or not 0 <= i < len(items):
+			raise self.NotConstant(index)
+
+		return int(i)
+
+	def expr(self, expr: Expr, frames: list[dict[str, Any]]) -> Any:
+
+		self.tick()
+
+		if isinstance(expr, NumLit): return TI_CONTEXT.create_decimal(expr.text)
+		if isinstance(expr, BoolLit): return Decimal(1 if expr.value else 0)
+		if isinstance(expr, StrLit): return expr.text
+		if isinstance(expr, Name): return self.lookup(expr.name, frames)
+
+		if isinstance(expr, Unary) and expr.op in ("-", "!"):
+			value = self.number(self.expr(expr.operand, frames))
+			return -value if expr.op == "-" else Decimal(value == 0)
+
+		if isinstance(expr, Binary):
+			return self.binary(expr.op, self.expr(expr.a, frames), self.expr(expr.b, frames))
+
+		if isinstance(expr, IndexExpr) and isinstance(expr.obj, Name):
+			items = self.lookup(expr.obj.name, frames)
+			return items[self.index(items, expr.index, frames)] if isinstance(items, list) else self.number(items)
+
+		if isinstance(expr, CallExpr):
+
+			info = None
+
+			if isinstance(expr.callee, Name):
+				info = self._compiler._fns.get(expr.callee.name)
+
+			elif isinstance(expr.callee, PathExpr):
+				info = self._compiler._fns.get(f"{expr.callee.owner}::{expr.callee.name}")
+
+			if info is None:
+				raise self.NotConstant(expr)
+
+			return self.call(info, [self.expr(arg, frames) for arg in expr.args])
+
+		raise self.NotConstant(expr)
+
+	def binary(self, op: str, a: Any, b: Any) -> Any:
+
+		if op == "+" and isinstance(a, str) and isinstance(b, str):
+			return a + b
+
+		a, b = self.number(a), self.number(b)
+
+		# like the calculator, which rounds every result to 14 digits
+		if op == "+": return TI_CONTEXT.add(a, b)
+		if op == "-": return TI_CONTEXT.subtract(a, b)
+		if op == "*": return TI_CONTEXT.multiply(a, b)
+
+		if op == "/":
+
+			if b == 0:
+				raise self.NotConstant("division by zero")
+
+			return TI_CONTEXT.divide(a, b)
+
+		return Decimal({
+			"==": a == b, "!=": a != b, "<": a < b, ">": a > b, "<=": a <= b, ">=": a >= b,
+			"&&": bool(a) and bool(b), "||": bool(a) or bool(b),
+		}[op])
+
+	def call(self, info: FnInfo, args: list[Any]) -> Any:
+		"""runs a function on known arguments, it only sees constants and its parameters"""
+
+		if len(args) != len(info.params):
+			raise self.NotConstant(info.name)
+
+		for (_, t), arg in zip(info.params, args):
+			if not (is_number(t) and isinstance(arg, Decimal) or t.core_type == CoreType.string and isinstance(arg, str)):
+				raise self.NotConstant(info.name)
+
+		outer, self._env = self._env, self._compiler._const_env()
+		value = self.block(info.node.body, [dict(zip((pname for pname, _ in info.params), args))])
+		self._env = outer
+
+		if info.ret.core_type == CoreType.unit:
+			return None
+
+		if not (is_number(info.ret) and isinstance(value, Decimal) or info.ret.core_type == CoreType.string and isinstance(value, str)):
+			raise self.NotConstant(info.name)
+
+		return value
+
+# the parser of each file compiled, so that compiling it again only re-parses the items that changed
+_parsers: dict[str, IncrementalParser] = {}
+
+def compile_source(source: str, main: str = "MAIN", filename: str = "?", parser: IncrementalParser or None = None) -> dict[str, str]:
+	"""compiles a whole source, returns the source of every program by program name. The items
+	are parsed by parser, by default the one kept for filename from the previous compilation"""
+
+	if parser is None:
+		parser = _parsers.setdefault(filename, IncrementalParser())
+
+	return Compiler(main, filename).compile(parser.parse(source))
@@ -0,0 +1,460 @@
+#encoding: utf-8
+
+from __future__ import annotations
+import os
+
+from abi import RAM_WORDS, RUNTIME_ABIS
+
+# Layout of the HN heap, shared by the python model and the generated programs.
+#
+# ⌊DAT holds the heap words. Every block is preceded by two header words:
+# the handle owning the block (0 when the block is free) and its class word,
+# which is the size class index for small blocks and minus the capacity for
+# large ones. Free blocks are chained through their first payload word.
+#
+# ⌊ADR is the handle table: ⌊ADR(h) is the base of the block of handle h,
+# free handles are chained through it as negated indices.
+#
+# Compaction slides live blocks down, either in one pause (HNDEFRAG) or in
+# bounded steps (HNDEFBG then HNDEFST at safe points). While an incremental
+# compaction runs, its read cursor is non zero and freed blocks are left as
+# holes instead of being put back on the free lists.
+
+DAT = "⌊DAT"
+ADR = "⌊ADR"
+STATE = "⌊HNS"
+CLASS_CAPS = "⌊HNC"
+CLASS_OF_SIZE = "⌊HNZ"
+REG = "θ"
+
+HEAP_WORDS = 999
+HANDLES = 999
+HEADER = 2
+SIZE_CLASSES: tuple[int, ...] = (1, 2, 3, 4, 5, 6, 8, 12, 16)
+MAX_SMALL = SIZE_CLASSES[-1]
+STEP_WORDS = 48
+
+TOP = 1
+FREE_HANDLE = 2
+NEXT_HANDLE = 3
+COMPACT_READ = 4
+COMPACT_WRITE = 5
+LARGE_HEAD = 6
+CLASS_HEADS = 7
+SCRATCH = CLASS_HEADS + len(SIZE_CLASSES)
+SCRATCH_NAMES: tuple[str, ...] = ("n", "c", "k", "b", "p", "f", "h", "q", "s")
+STATE_WORDS = SCRATCH + len(SCRATCH_NAMES) - 1
+
+def class_of_size(n: int) -> int:
+	"""returns the index of the smallest size class holding n words, 0 if n is too large"""
+
+	for c, cap in enumerate(SIZE_CLASSES, start=1):
+		if cap >= n:
+			return c
+
+	return 0
+
+def class_head(c: int) -> int:
+	return CLASS_HEADS + c - 1
+
+class Heap:
+	"""word-exact model of the calculator heap, mirroring the generated runtime programs"""
+
+	class OutOfMemory(Exception): ...
+	class OutOfHandles(Exception): ...
+	class InvalidHandle(Exception): ...
+
+	def __init__(self):
+
+		# index 0 is unused so that indices match the 1-based calculator lists
+		self.dat: list[float] = [0]*(HEAP_WORDS + 1)
+		self.adr: list[int] = [0]*(HANDLES + 1)
+		self.state: list[int] = [0]*(STATE_WORDS + 1)
+		self.state[TOP] = 1
+		self.state[NEXT_HANDLE] = 1
+
+	def capacity(self, class_word: int) -> int:
+		return SIZE_CLASSES[class_word - 1] if class_word > 0 else -class_word
+
+	def _bump(self, cap: int) -> int:
+
+		base = self.state[TOP] + HEADER
+
+		if base + cap - 1 > HEAP_WORDS:
+			raise self.OutOfMemory(f"cannot allocate {cap} words")
+
+		self.state[TOP] = base + cap
+		return base
+
+	def _take_large(self, n: int) -> tuple[int, int]:
+		"""unlinks the first large free block holding n words, returns its base and capacity"""
+
+		prev, base = 0, self.state[LARGE_HEAD]
+
+		while base:
+
+			if -self.dat[base - 1] >= n:
+
+				if prev: self.dat[prev] = self.dat[base]
+				else: self.state[LARGE_HEAD] = self.dat[base]
+
+				return base, -self.dat[base - 1]
+
+			prev, base = base, self.dat[base]
+
+		return 0, n
+
+	def _new_handle(self) -> int:
+
+		handle = self.state[FREE_HANDLE]
+
+		if handle:
+			self.state[FREE_HANDLE] = -self.adr[handle]
+			return handle
+
+		handle = self.state[NEXT_HANDLE]
+
+		if handle > HANDLES:
+			raise self.OutOfHandles
+
+		self.state[NEXT_HANDLE] = handle + 1
+		return handle
+
+	def alloc(self, values: list[float]) -> int:
+		"""allocates a block initialised with values and returns its handle"""
+
+		n = max(len(values), 1)
+		c = class_of_size(n)
+
+		if c:
+
+			cap = SIZE_CLASSES[c - 1]
+			base = self.state[class_head(c)]
+
+			if base:
+				self.state[class_head(c)] = self.dat[base]
+
+		else:
+			base, cap = self._take_large(n)
+
+		if not base:
+			base = self._bump(cap)
+
+		self.dat[base - 1] = c if c else -cap
+
+		handle = self._new_handle()
+		self.adr[handle] = base
+		self.dat[base - 2] = handle
+
+		for i, v in enumerate(values):
+			self.dat[base + i] = v
+
+		return handle
+
+	def alloc_vec(self, size: int) -> int:
+		"""allocates a zeroed block of size words and returns its handle"""
+		return self.alloc([0]*max(size, 1))
+
+	def base(self, handle: int) -> int:
+
+		if not 0 < handle <= HANDLES or self.adr[handle] <= 0:
+			raise self.InvalidHandle(handle)
+
+		return self.adr[handle]
+
+	def free(self, handle: int):
+
+		base = self.base(handle)
+		c = self.dat[base - 1]
+		self.dat[base - 2] = 0
+
+		if not self.compacting():
+			head = class_head(c) if c > 0 else LARGE_HEAD
+			self.dat[base] = self.state[head]
+			self.state[head] = base
+
+		self.adr[handle] = -self.state[FREE_HANDLE]
+		self.state[FREE_HANDLE] = handle
+
+	def compacting(self) -> bool:
+		return self.state[COMPACT_READ] != 0
+
+	def begin_defrag(self):
+		"""starts an incremental compaction, the free lists are dropped until it ends"""
+
+		if self.compacting():
+			return
+
+		for head in range(LARGE_HEAD, SCRATCH):
+			self.state[head] = 0
+
+		self.state[COMPACT_READ] = 1
+		self.state[COMPACT_WRITE] = 1
+
+	def defrag_step(self, budget: int or None = STEP_WORDS) -> int:
+		"""slides live blocks down until budget words were scanned, returns the words scanned"""
+
+		p, q = self.state[COMPACT_READ], self.state[COMPACT_WRITE]
+		scanned = 0
+
+		if not p:
+			return scanned
+
+		while p < self.state[TOP] and (budget is None or scanned < budget):
+
+			size = HEADER + self.capacity(self.dat[p + 1])
+			handle = self.dat[p]
+
+			if handle:
+
+				if p != q:
+					self.dat[q:q + size] = self.dat[p:p + size]
+					self.adr[handle] = q + HEADER
+
+				q += size
+
+			p += size
+			scanned += size
+
+		if p >= self.state[TOP]:
+			self.state[TOP] = q
+			self.state[COMPACT_READ] = 0
+
+		else:
+			self.state[COMPACT_READ] = p
+			self.state[COMPACT_WRITE] = q
+
+		return scanned
+
+	def defrag(self):
+		"""slides every live block down to the start of the heap in one pause"""
+
+		self.begin_defrag()
+		self.defrag_step(None)
+
+	def read(self, handle: int, i: int) -> float:
+		return self.dat[self.base(handle) + i]
+
+	def write(self, handle: int, i: int, v: float):
+		self.dat[self.base(handle) + i] = v
+
+	def used_words(self) -> int:
+		return self.state[TOP] - 1
+
+def _state(i: int or str) -> str:
+	return f"{STATE}({i})"
+
+def _program(*lines: str) -> str:
+	"""fills the scratch placeholders of a program"""
+
+	scratch = {name: _state(SCRATCH + i) for i, name in enumerate(SCRATCH_NAMES)}
+	return "\n".join(line.format(**scratch) for line in lines)
+
+def _class_head(c: str) -> str:
+	return _state(f"{CLASS_HEADS - 1}+{c}")
+
+def _panic(text: str) -> tuple[str, ...]:
+	return (f'Disp "{text}"', "Stop")
+
+def program_init() -> str:
+
+	return _program(
+		f"{{{{0→{DAT}",
+		f"{HEAP_WORDS}→dim({DAT})",
+		f"{{{{0→{ADR}",
+		f"{HANDLES}→dim({ADR})",
+		f"{{{{0→{STATE}",
+		f"{STATE_WORDS}→dim({STATE})",
+		# variables and the argument window live in ⌊RAM, growing it keeps those already set
+		f"{RAM_WORDS}→dim(⌊RAM)",
+		f"1→{_state(TOP)}",
+		f"1→{_state(NEXT_HANDLE)}",
+		"{{" + ",".join(str(cap) for cap in SIZE_CLASSES) + f"→{CLASS_CAPS}",
+		"{{" + ",".join(str(class_of_size(n)) for n in range(1, MAX_SMALL + 1)) + f"→{CLASS_OF_SIZE}",
+	)
+
+def _allocate(abi_name: str) -> tuple[str, ...]:
+	"""finds a block for the size argument, leaves its base in b and its handle in h"""
+
+	return (
+		f"max(1,{RUNTIME_ABIS[abi_name].arg(0)})→{{n}}",
+		"0→{b}",
+		f"If {{n}}≤{MAX_SMALL}: Then",
+		f"{CLASS_OF_SIZE}({{n}})→{{c}}",
+		f"{CLASS_CAPS}({{c}})→{{k}}",
+		f"{_class_head('{c}')}→{{b}}",
+		"If {b}: Then",
+		f"{DAT}({{b}})→{_class_head('{c}')}",
+		"End",
+		"Else",
+		"0→{c}",
+		"{n}→{k}",
+		"0→{p}",
+		"0→{f}",
+		f"{_state(LARGE_HEAD)}→{{b}}",
+		"While {b}",
+		f"If ⁻{DAT}({{b}}-1)≥{{n}}: Then",
+		"If {p}: Then",
+		f"{DAT}({{b}})→{DAT}({{p}})",
+		"Else",
+		f"{DAT}({{b}})→{_state(LARGE_HEAD)}",
+		"End",
+		f"⁻{DAT}({{b}}-1)→{{k}}",
+		"{b}→{f}",
+		"0→{b}",
+		"Else",
+		"{b}→{p}",
+		f"{DAT}({{b}})→{{b}}",
+		"End",
+		"End",
+		"{f}→{b}",
+		"End",
+		"If non({b}): Then",
+		f"{_state(TOP)}+{HEADER}→{{b}}",
+		f"If {{b}}+{{k}}-1>{HEAP_WORDS}: Then",
+		*_panic("HEAP FULL"),
+		"End",
+		f"{{b}}+{{k}}→{_state(TOP)}",
+		"End",
+		"If {c}: Then",
+		f"{{c}}→{DAT}({{b}}-1)",
+		"Else",
+		f"⁻{{k}}→{DAT}({{b}}-1)",
+		"End",
+		f"{_state(FREE_HANDLE)}→{REG}",
+		f"If {REG}: Then",
+		f"⁻{ADR}({REG})→{_state(FREE_HANDLE)}",
+		"Else",
+		f"{_state(NEXT_HANDLE)}→{REG}",
+		f"If {REG}>{HANDLES}: Then",
+		*_panic("OUT OF HANDLES"),
+		"End",
+		f"{REG}+1→{_state(NEXT_HANDLE)}",
+		"End",
+		f"{{b}}→{ADR}({REG})",
+		f"{REG}→{DAT}({{b}}-{HEADER})",
+		f"{REG}→{{h}}",
+	)
+
+def program_alloc() -> str:
+
+	return _program(
+		*_allocate("HNALLOC"),
+		f"For({REG},1,{{n}}",
+		f"{RUNTIME_ABIS['HNALLOC'].window(f'{REG}-1')}→{DAT}({{b}}+{REG}-1)",
+		"End",
+		"{h}",
+	)
+
+def program_alloc_vec() -> str:
+
+	return _program(
+		*_allocate("HNALLVEC"),
+		f"For({REG},0,{{n}}-1",
+		f"0→{DAT}({{b}}+{REG})",
+		"End",
+		"{h}",
+	)
+
+def program_free() -> str:
+
+	return _program(
+		f"{RUNTIME_ABIS['HNFREE'].arg(0)}→{REG}",
+		f"{ADR}({REG})→{{b}}",
+		f"0→{DAT}({{b}}-{HEADER})",
+		f"{DAT}({{b}}-1)→{{c}}",
+		f"If non({_state(COMPACT_READ)}): Then",
+		"If {c}>0: Then",
+		f"{_class_head('{c}')}→{DAT}({{b}})",
+		f"{{b}}→{_class_head('{c}')}",
+		"Else",
+		f"{_state(LARGE_HEAD)}→{DAT}({{b}})",
+		f"{{b}}→{_state(LARGE_HEAD)}",
+		"End",
+		"End",
+		f"⁻{_state(FREE_HANDLE)}→{ADR}({REG})",
+		f"{REG}→{_state(FREE_HANDLE)}",
+	)
+
+def _begin_defrag() -> tuple[str, ...]:
+
+	return (
+		f"If non({_state(COMPACT_READ)}): Then",
+		f"For({REG},{LARGE_HEAD},{SCRATCH - 1}",
+		f"0→{STATE}({REG})",
+		"End",
+		f"1→{_state(COMPACT_READ)}",
+		f"1→{_state(COMPACT_WRITE)}",
+		"End",
+	)
+
+def _defrag_step(budget: int or None) -> tuple[str, ...]:
+
+	return (
+		f"{_state(COMPACT_READ)}→{{p}}",
+		f"{_state(COMPACT_WRITE)}→{{q}}",
+		"0→{k}",
+		f"While {{p}}<{_state(TOP)}" + (f" et {{k}}<{budget}" if budget is not None else ""),
+		f"{DAT}({{p}}+1)→{{c}}",
+		"If {c}>0: Then",
+		f"{CLASS_CAPS}({{c}})+{HEADER}→{{s}}",
+		"Else",
+		f"{HEADER}-{{c}}→{{s}}",
+		"End",
+		f"{DAT}({{p}})→{{h}}",
+		"If {h}: Then",
+		"If {p}≠{q}: Then",
+		f"For({REG},0,{{s}}-1",
+		f"{DAT}({{p}}+{REG})→{DAT}({{q}}+{REG})",
+		"End",
+		f"{{q}}+{HEADER}→{ADR}({{h}})",
+		"End",
+		"{q}+{s}→{q}",
+		"End",
+		"{p}+{s}→{p}",
+		"{k}+{s}→{k}",
+		"End",
+		f"If {{p}}≥{_state(TOP)}: Then",
+		f"{{q}}→{_state(TOP)}",
+		f"0→{_state(COMPACT_READ)}",
+		"Else",
+		f"{{p}}→{_state(COMPACT_READ)}",
+		f"{{q}}→{_state(COMPACT_WRITE)}",
+		"End",
+	)
+
+def program_defrag() -> str:
+	return _program(*_begin_defrag(), *_defrag_step(None))
+
+def program_begin_defrag() -> str:
+	return _program(*_begin_defrag())
+
+def program_defrag_step(budget: int = STEP_WORDS) -> str:
+
+	return _program(
+		f"If non({_state(COMPACT_READ)})",
+		"Return",
+		*_defrag_step(budget),
+	)
+
+def runtime_programs() -> dict[str, str]:
+	"""returns the source of every runtime program, by program name"""
+
+	return {
+		"HNINIT": program_init(),
+		"HNALLOC": program_alloc(),
+		"HNALLVEC": program_alloc_vec(),
+		"HNFREE": program_free(),
+		"HNDEFRAG": program_defrag(),
+		"HNDEFBG": program_begin_defrag(),
+		"HNDEFST": program_defrag_step(),
+	}
+
+def write_runtime(directory: str = "."):
+
+	for name, source in runtime_programs().items():
+		with open(os.path.join(directory, f"{name}.txt"), "w", encoding="utf-8") as file:
+			file.write(source)
+
+if __name__ == "__main__":
+	write_runtime()
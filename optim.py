@@ -0,0 +1,657 @@
+#encoding: utf-8
+
+from __future__ import annotations
+import re
+from typing import Callable
+
+from abi import ARG_REGS, ARG_WINDOW, RUNTIME_ABIS
+
+# Passes rewriting the emitted program. A pass takes the program lines and
+# the spare variables (never allocated by the planners) and returns new lines.
+Pass = Callable[[list[str], list[str]], list[str]]
+
+_TOKEN = re.compile(
+	r'"[^"→]*"?'
+	r'|⌊[A-Zθ][A-Z0-9θ]{0,4}'
+	r'|prgm[A-Zθ][A-Z0-9θ]*'
+	r'|Chn\d'
+	r'|[A-Z][a-z][A-Za-z]*\(?'
+	r'|[a-z][A-Za-zé]*\(?'
+	r'|[A-Zθ]'
+	r'|(?:\d+\.?\d*|\.\d+)(?:ᴇ⁻?\d+)?|ᴇ⁻?\d+'
+	r'|\s+'
+	r'|.'
+)
+
+_STRING_VAR = re.compile(r"Chn\d")
+
+def tokenize(line: str) -> list[str]:
+	"""splits a line in tokens, joining them gives the line back"""
+	return _TOKEN.findall(line)
+
+def is_var(token: str) -> bool:
+	return len(token) == 1 and (token.isupper() or token == "θ")
+
+def is_string_var(token: str) -> bool:
+	return _STRING_VAR.fullmatch(token) is not None
+
+def is_literal(token: str) -> bool:
+	return token.startswith('"')
+
+def is_int(token: str) -> bool:
+	return token.isdigit()
+
+def opens_block(line: str) -> bool:
+	return line.startswith(("While ", "For(")) or line.startswith("If ") and line.replace(" ", "").endswith(":Then")
+
+def is_single_if(line: str) -> bool:
+	return line.startswith("If ") and not opens_block(line)
+
+def is_store_to(line: str, target: str) -> bool:
+	return line.endswith(f"→{target}")
+
+def used_names(lines: list[str]) -> set[str]:
+	"""returns every variable and list element text appearing in the lines"""
+
+	names = set()
+
+	for line in lines:
+
+		tokens = tokenize(line)
+		names.update(t for t in tokens if is_var(t) or is_string_var(t))
+
+		for i, t in enumerate(tokens[:-3]):
+			if t == "⌊RAM" and tokens[i + 1] == "(" and is_int(tokens[i + 2]) and tokens[i + 3] == ")":
+				names.add(f"⌊RAM({tokens[i + 2]})")
+
+	return names
+
+_RAM_SLOT = re.compile(r"⌊RAM\((\d+)\)")
+# an element of ⌊RAM whose index is computed, it may be any of them
+_RAM_COMPUTED = re.compile(r"⌊RAM\((?!\d+\))")
+
+def mentions(line: str, var: str) -> bool:
+	"""tells if the line may read or write var, a letter or a ⌊RAM element"""
+
+	if _RAM_SLOT.fullmatch(var):
+		return var in line or _RAM_COMPUTED.search(line) is not None
+
+	# most lines don't hold the letter at all, tokenizing is only needed to tell it from a name holding it
+	return var in line and var in used_names([line])
+
+def callee_reads(var: str) -> bool:
+	"""tells if a called program may read var: it finds its arguments in ARG_REGS and
+	the window, and reads any list element through the addresses it computes"""
+	return not is_var(var) or var in ARG_REGS
+
+def free_spares(lines: list[str], spares: list[str]) -> list[str]:
+	"""returns the spare number variables still unused by the lines, letters first"""
+
+	used = used_names(lines)
+	return [s for s in spares if s not in used and not is_string_var(s)]
+
+def balanced(lines: list[str], start: int, end: int) -> bool:
+	"""tells if lines[start:end] neither leaves nor splits the block it starts in"""
+
+	depth = 0
+
+	for line in lines[start:end]:
+
+		if line == "End":
+			depth -= 1
+			if depth < 0: return False
+
+		elif line == "Else":
+			if depth == 0: return False
+
+		elif opens_block(line):
+			depth += 1
+
+	return depth == 0
+
+def _member_index(tokens: list[str], i: int) -> int or None:
+	"""returns k if tokens[i] is the handle in ⌊DAT(⌊ADR(X)+k)"""
+
+	if i < 4 or i + 4 >= len(tokens):
+		return None
+
+	if tokens[i - 4:i] != ["⌊DAT", "(", "⌊ADR", "("] or tokens[i + 1:i + 3] != [")", "+"] or tokens[i + 4] != ")":
+		return None
+
+	return int(tokens[i + 3]) if is_int(tokens[i + 3]) else None
+
+def _alloc_args(lines: list[str], call: int) -> tuple[int, list[str]] or None:
+	"""returns the first line passing the arguments of the HNALLOC call and the initial values"""
+
+	abi = RUNTIME_ABIS["HNALLOC"]
+
+	for start in range(call - 1, max(call - ARG_WINDOW - 2, -1), -1):
+
+		size, _, target = lines[start].rpartition("→")
+
+		if target != abi.arg(0):
+			continue
+
+		if not is_int(size) or start + int(size) + 1 != call:
+			return None
+
+		values = [lines[start + 1 + k].rpartition("→") for k in range(int(size))]
+
+		if any(target != abi.arg(abi.regs + k) for k, (_, _, target) in enumerate(values)):
+			return None
+
+		return start, [value for value, _, _ in values]
+
+	return None
+
+def _find_free(lines: list[str], handle: str, start: int) -> int or None:
+
+	abi = RUNTIME_ABIS["HNFREE"]
+
+	for j in range(start, len(lines) - 1):
+		if lines[j] == f"{handle}→{abi.arg(0)}" and lines[j + 1] == "prgmHNFREE":
+			return j
+
+	return None
+
+def _local_members(lines: list[str], handle: str, start: int, end: int, size: int) -> set[int] or None:
+	"""returns the members used in lines[start:end], None if the handle escapes"""
+
+	members = set()
+
+	for line in lines[start:end]:
+
+		tokens = tokenize(line)
+
+		for i, t in enumerate(tokens):
+
+			if t != handle:
+				continue
+
+			k = _member_index(tokens, i)
+
+			if k is None or k >= size:
+				return None
+
+			members.add(k)
+
+	return members
+
+def promote_local_structs(lines: list[str], spares: list[str]) -> list[str]:
+	"""escape analysis: struct instances whose handle is only used for constant member
+	accesses between HNALLOC and HNFREE get their members in spare variables instead"""
+
+	lines = list(lines)
+	spares = free_spares(lines, spares)
+	# spares are handed back once the region holding them is over
+	busy: list[tuple[int, str]] = []
+	i = 0
+
+	while i < len(lines) - 1:
+
+		if not (lines[i] == "prgmHNALLOC" and lines[i + 1].startswith("Rep→")):
+			i += 1
+			continue
+
+		call = i
+		handle = lines[call + 1][len("Rep→"):]
+		args = _alloc_args(lines, call)
+		end = _find_free(lines, handle, call + 2) if is_var(handle) and args is not None else None
+
+		if end is None:
+			i += 1
+			continue
+
+		i, values = args
+
+		if is_single_if(lines[i - 1] if i else "") or is_single_if(lines[end - 1]) or not balanced(lines, call + 2, end):
+			i = call + 1
+			continue
+
+		members = _local_members(lines, handle, call + 2, end, len(values))
+
+		for until, slot in list(busy):
+			if until < i:
+				busy.remove((until, slot))
+				spares.insert(0, slot)
+
+		if members is None or len(members) > len(spares):
+			i = call + 1
+			continue
+
+		slots = {k: spares.pop(0) for k in sorted(members)}
+		body = lines[call + 2:end]
+		busy.extend((i + len(slots) + len(body), slot) for slot in slots.values())
+		pattern = re.compile(rf"⌊DAT\(⌊ADR\({handle}\)\+(\d+)\)")
+		body = [pattern.sub(lambda m: slots[int(m.group(1))], line) for line in body]
+		stores = [f"{values[k]}→{slot}" for k, slot in slots.items()]
+
+		lines[i:end + 2] = stores + body
+		i += len(stores)
+
+	return lines
+
+def block_end(lines: list[str], start: int) -> int or None:
+	"""returns the index of the End closing the block opened at start"""
+
+	depth = 0
+
+	for j in range(start, len(lines)):
+
+		if opens_block(lines[j]):
+			depth += 1
+
+		elif lines[j] == "End":
+
+			depth -= 1
+
+			if depth == 0:
+				return j
+
+	return None
+
+def _handle_definition(lines: list[str], handle: str, loop: int) -> int or None:
+	"""returns the line of the HNALLOC result store that last defined handle before loop,
+	None if that definition is conditional or is not an allocation"""
+
+	depth = 0
+
+	for j in range(loop - 1, -1, -1):
+
+		line = lines[j]
+
+		# lines of a closed block, or of the Then branch when coming from an Else, are conditional
+		if line == "End" or line == "Else" and depth == 0: depth += 1
+		elif opens_block(line): depth = max(depth - 1, 0)
+
+		if handle in (t for t in tokenize(line) if is_var(t)) and (is_store_to(line, handle) or line.startswith(f"For({handle},")):
+
+			if depth or line != f"Rep→{handle}" or j < 1 or lines[j - 1] not in ("prgmHNALLOC", "prgmHNALLVEC"):
+				return None
+
+			return j
+
+	return None
+
+def _loop_members(lines: list[str], start: int, end: int) -> dict[str, set[int]] or None:
+	"""returns the constant members accessed in the loop by handle, None if the loop
+	may touch them behind our back"""
+
+	accesses: dict[str, set[int]] = {}
+	bare: set[str] = set()
+
+	for line in lines[start:end + 1]:
+
+		tokens = tokenize(line)
+
+		if any(t.startswith("prgm") and t not in ("prgmHNALLOC", "prgmHNFREE", "prgmHNDEFST") for t in tokens) or line == "Return" or line.startswith("Goto "):
+			return None
+
+		for i, t in enumerate(tokens):
+
+			if not is_var(t):
+				continue
+
+			k = _member_index(tokens, i)
+
+			if k is None: bare.add(t)
+			else: accesses.setdefault(t, set()).add(k)
+
+	return {h: ks for h, ks in accesses.items() if h not in bare}
+
+def cache_loop_members(lines: list[str], spares: list[str]) -> list[str]:
+	"""scalar replacement: constant members of unaliased struct instances used in a loop
+	are loaded in spare variables before it and stored back after it"""
+
+	lines = list(lines)
+	spares = free_spares(lines, spares)
+	i = 0
+
+	while i < len(lines):
+
+		if not lines[i].startswith(("While ", "For(")) or i and is_single_if(lines[i - 1]):
+			i += 1
+			continue
+
+		end = block_end(lines, i)
+		members = _loop_members(lines, i, end) if end is not None else None
+		# member access text -> variable caching it
+		slots: dict[str, str] = {}
+
+		for handle, ks in sorted((members or {}).items()):
+
+			definition = _handle_definition(lines, handle, i)
+
+			if definition is None or len(ks) > len(spares) or any(handle in tokenize(line) for line in lines[definition + 1:i]):
+				continue
+
+			slots.update({f"⌊DAT(⌊ADR({handle})+{k})": spares.pop(0) for k in sorted(ks)})
+
+		if not slots:
+			i += 1
+			continue
+
+		pattern = re.compile("|".join(re.escape(access) for access in slots))
+		body = [pattern.sub(lambda m: slots[m.group(0)], line) for line in lines[i:end + 1]]
+		loads = [f"{access}→{slot}" for access, slot in slots.items()]
+		stores = [f"{slot}→{access}" for access, slot in slots.items() if any(is_store_to(line, access) for line in lines[i:end + 1])]
+
+		lines[i:end + 1] = loads + body + stores
+		i += len(loads) + 1
+
+	return lines
+
+_FOR = re.compile(r"For\(([A-Zθ]),(\d+),(\d+)(?:,(\d+))?\)?")
+# operands no neighbouring operator or implicit multiplication binds tighter: a term is
+# preceded by an operator of lower priority, a factor may also follow a * and be followed by * or /
+_TERM_BEFORE = r"(?:(?<=^)|(?<=[(,+{ =≠<>≤≥]))"
+_TERM_AFTER = r"(?=$|[),+\-→}=≠<>≤≥ :])"
+_FACTOR_BEFORE = r"(?:(?<=^)|(?<=[(,+\-*{ =≠<>≤≥]))"
+_FACTOR_AFTER = r"(?=$|[),+\-*/→}=≠<>≤≥ :])"
+# a factor whose value doesn't matter once multiplied by 0
+_OPERAND = r"(?:\d+|[A-Zθ]|Rep|⌊RAM\(\d+\))"
+
+def _integer(n: int) -> str:
+	return str(n) if n >= 0 else f"⁻{-n}"
+
+# rewrites folding constant arithmetic, applied until none matches
+_FOLDS: list[tuple[re.Pattern, Callable[[re.Match], str]]] = [
+	(re.compile(rf"{_FACTOR_BEFORE}(\d+)\*(\d+){_FACTOR_AFTER}"), lambda m: str(int(m.group(1)) * int(m.group(2)))),
+	(re.compile(rf"{_TERM_BEFORE}(\d+)\+(\d+){_TERM_AFTER}"), lambda m: str(int(m.group(1)) + int(m.group(2)))),
+	(re.compile(rf"{_TERM_BEFORE}(\d+)-(\d+){_TERM_AFTER}"), lambda m: _integer(int(m.group(1)) - int(m.group(2)))),
+	(re.compile(rf"{_FACTOR_BEFORE}(?:0\*{_OPERAND}|{_OPERAND}\*0){_FACTOR_AFTER}"), lambda m: "0"),
+	(re.compile(rf"{_FACTOR_BEFORE}1\*({_OPERAND}){_FACTOR_AFTER}"), lambda m: m.group(1)),
+	(re.compile(rf"{_FACTOR_BEFORE}({_OPERAND})\*1{_FACTOR_AFTER}"), lambda m: m.group(1)),
+	# additions of 0 after a parenthesis stay, ⌊ADR(X)+0 is how the passes find member 0
+	(re.compile(rf"(?<!\))[+\-]0{_TERM_AFTER}"), lambda m: ""),
+	(re.compile(rf"(?:(?<=^)|(?<=[(,{{ =≠<>≤≥]))0\+"), lambda m: ""),
+]
+
+def _stores_itself(line: str) -> bool:
+
+	value, arrow, target = line.rpartition("→")
+	return arrow and value == target
+
+_LITERAL = re.compile(r'("[^"→]*"?)')
+
+def fold_constants(line: str) -> str:
+	"""folds the constant arithmetic left by substituting a constant for a variable,
+	string literals are left as they are"""
+
+	parts = _LITERAL.split(line)
+
+	# string literals are at odd indices
+	for i in range(0, len(parts), 2):
+
+		folded = None
+
+		while folded != parts[i]:
+
+			folded = parts[i]
+
+			for pattern, fold in _FOLDS:
+				parts[i] = pattern.sub(fold, parts[i])
+
+	return "".join(parts)
+
+def read_later(lines: list[str], start: int, var: str) -> bool:
+	"""tells if var may be read from lines[start] on before being overwritten"""
+
+	depth = 0
+
+	for j in range(start, len(lines)):
+
+		line = lines[j]
+
+		if line.startswith(("Lbl ", "Goto ")):
+			return True
+
+		# called programs read their arguments and the heap
+		if line.startswith("prgm") and callee_reads(var):
+			return True
+
+		if mentions(line, var):
+			# only an unconditional store that doesn't read var itself overwrites it
+			return depth > 0 or not is_store_to(line, var) or mentions(line.rpartition("→")[0], var) or is_single_if(lines[j - 1])
+
+		if line == "End":
+			depth -= 1
+			# leaving an enclosing loop may go back to code reading var
+			if depth < 0: return True
+
+		elif line == "Else" and depth == 0:
+			return True
+
+		elif opens_block(line):
+			depth += 1
+
+	return False
+
+def unrolling(trips: int = 8, size: int = 64) -> Pass:
+	"""returns a pass replacing the For( loops with constant bounds, at most trips iterations and
+	size lines once unrolled, by their body repeated with the loop variable replaced by its value"""
+
+	def unroll_loops(lines: list[str], spares: list[str]) -> list[str]:
+
+		lines = list(lines)
+
+		# going up unrolls inner loops first, their outer loop may qualify afterwards
+		for i in range(len(lines) - 1, -1, -1):
+
+			m = _FOR.fullmatch(lines[i])
+
+			if m is None or i and is_single_if(lines[i - 1]):
+				continue
+
+			end = block_end(lines, i)
+
+			if end is None:
+				continue
+
+			var, start, stop, step = m.group(1), int(m.group(2)), int(m.group(3)), int(m.group(4) or 1)
+			body = lines[i + 1:end]
+			values = list(range(start, stop + 1, step)) if step else []
+
+			if not step or len(values) > trips or len(values) * len(body) > size:
+				continue
+
+			# the body must neither move the loop variable nor hold labels that copies would duplicate
+			if any(is_store_to(line, var) or line.startswith((f"For({var},", "Lbl ")) for line in body):
+				continue
+
+			unrolled = [fold_constants("".join(str(n) if t == var else t for t in tokenize(line))) for n in values for line in body]
+			after = unrolled + lines[end + 1:]
+			# folding leaves stores of a variable to itself where the loop variable only added 0, they
+			# only change Ans
+			unrolled = [
+				line for k, line in enumerate(unrolled)
+				if not _stores_itself(line) or k and is_single_if(unrolled[k - 1]) or ans_live(after, k + 1)
+			]
+
+			# the variable keeps the value For( leaves if it may be read later
+			if read_later(lines, end + 1, var):
+				unrolled.append(f"{start + len(values) * step}→{var}")
+
+			lines[i:end + 1] = unrolled
+
+		return lines
+
+	return unroll_loops
+
+unroll_loops = unrolling()
+
+def clobbers_ans(line: str) -> bool:
+	"""tells if running the line may change Ans, which stores and expressions do"""
+	return not line.startswith(("If ", "While ", "For(", "End", "Else", "Then", "Lbl ", "Goto ", "Return", "Stop", "Disp ", "Output(", "ClrHome", "Input ", "Prompt ", "Pause"))
+
+# lines leaving Ans alone that a value may be kept in Ans across
+_KEEPS_ANS = ("Disp ", "Output(", "ClrHome")
+
+def ans_live(lines: list[str], start: int) -> bool:
+	"""tells if a line from lines[start] on reads Ans before a line changes it, inside the block"""
+
+	for line in lines[start:]:
+
+		if "Rep" in tokenize(line):
+			return True
+
+		if clobbers_ans(line) or line.startswith(("End", "Else", "Then", "Lbl ", "Goto ")):
+			return False
+
+	return False
+
+def _substitute(line: str, var: str, value: str) -> str:
+
+	if is_var(var):
+		return "".join(value if t == var else t for t in tokenize(line))
+
+	return line.replace(var, value)
+
+def reuse_ans(lines: list[str], spares: list[str]) -> list[str]:
+	"""drops the stores of temporaries whose value is only read by a following line,
+	that line reading Ans instead: a store leaves the stored value in Ans"""
+
+	lines = list(lines)
+	i = 0
+
+	while i < len(lines):
+
+		value, arrow, target = lines[i].rpartition("→")
+
+		if not arrow or not (is_var(target) or _RAM_SLOT.fullmatch(target)) or i and is_single_if(lines[i - 1]):
+			i += 1
+			continue
+
+		j = i + 1
+
+		while j < len(lines) and lines[j].startswith(_KEEPS_ANS) and not mentions(lines[j], target):
+			j += 1
+
+		# loop conditions are read again once Ans changed, other lines don't read the temporary or hand it to a callee
+		if j == len(lines) or lines[j].startswith(("While ", "For(", "End", "Else", "Then", "Lbl ", "Goto ", "Return", "Stop", "prgm", "Input ", "Prompt ", "Pause")):
+			i += 1
+			continue
+
+		line = lines[j]
+		read, arrow, destination = line.rpartition("→") if "→" in line else (line, "", "")
+		# storing to the temporary again means its old value is not needed anymore
+		overwritten = destination == target
+		# only the slot text is replaced, a computed index may land on the slot and would read it stale
+		replaceable = is_var(target) or target in read and _RAM_COMPUTED.search(read) is None
+
+		if not replaceable or not mentions(read, target) or destination and not overwritten and mentions(destination, target) or not overwritten and read_later(lines, j + 1, target):
+			i += 1
+			continue
+
+		lines[j] = _substitute(read, target, "Rep") + arrow + destination
+
+		if value == "Rep":
+			del lines[i]
+
+		else:
+			lines[i] = value
+
+		# the line reading Ans may itself be a store of a temporary
+		i = max(i - 1, 0)
+
+	# a line only evaluating Ans does nothing, unless an If guards it
+	return [line for n, line in enumerate(lines) if line != "Rep" or n and is_single_if(lines[n - 1])]
+
+# lines whose literals must stay literals
+_LITERAL_ONLY = ("Input ", "Prompt ", "Lbl ", "Goto ")
+
+def _top_blocks(lines: list[str]) -> tuple[list[int], list[int], list[bool]]:
+	"""returns for each line the first and last line of the outermost block holding it,
+	the line itself when it is in no block, and if it is in a loop"""
+
+	starts, ends, looped = [], [], []
+	depth, start, loops = 0, 0, []
+
+	for i, line in enumerate(lines):
+
+		if depth == 0:
+			# a line guarded by a one-line If starts with its If
+			start = i - 1 if i and is_single_if(lines[i - 1]) else i
+
+		if opens_block(line):
+			depth += 1
+			loops.append(not line.startswith("If "))
+
+		starts.append(start)
+		looped.append(any(loops))
+
+		if line == "End":
+			depth -= 1
+			if loops: loops.pop()
+
+	for i in range(len(lines) - 1, -1, -1):
+		ends.insert(0, i if i + 1 == len(lines) or starts[i + 1] != starts[i] else ends[0])
+
+	return starts, ends, looped
+
+def pool_strings(lines: list[str], spares: list[str]) -> list[str]:
+	"""string pooling: literals written several times or read in a loop are stored once in
+	spare string registers, literals whose live ranges don't overlap sharing a register, and
+	the literals left without a register stay inline"""
+
+	used = used_names(lines)
+	registers = [s for s in spares if is_string_var(s) and s not in used]
+
+	# jumps make the live ranges unknown
+	if not registers or any(line.startswith(("Lbl ", "Goto ")) for line in lines):
+		return lines
+
+	starts, ends, looped = _top_blocks(lines)
+	uses: dict[str, list[int]] = {}
+
+	for i, line in enumerate(lines):
+		if not line.startswith(_LITERAL_ONLY):
+			for t in tokenize(line):
+				if is_literal(t):
+					uses.setdefault(t.strip('"'), []).append(i)
+
+	def gain(text: str) -> int:
+		"""bytes saved by pooling text, literals read in a loop are worth their size on each pass"""
+
+		size = len(text) + 2
+		return sum(size * (8 if looped[i] else 1) - 2 for i in uses[text]) - (size + 4)
+
+	# literal -> register, first and last line of its live range
+	pooled: dict[str, tuple[str, int, int]] = {}
+
+	for text in sorted(uses, key=gain, reverse=True):
+
+		if gain(text) <= 0:
+			break
+
+		first, last = starts[uses[text][0]], ends[uses[text][-1]]
+
+		# the load changes Ans, which the line it goes before may still read
+		if ans_live(lines, first):
+			continue
+
+		for register in registers:
+			if all(r != register or last < a or b < first for r, a, b in pooled.values()):
+				pooled[text] = (register, first, last)
+				break
+
+	if not pooled:
+		return lines
+
+	loads: dict[int, list[str]] = {}
+
+	for text, (register, first, _) in pooled.items():
+		loads.setdefault(first, []).append(f'"{text}"→{register}')
+
+	result = []
+
+	for i, line in enumerate(lines):
+
+		result.extend(loads.get(i, []))
+
+		if not line.startswith(_LITERAL_ONLY):
+			line = "".join(pooled[t.strip('"')][0] if is_literal(t) and t.strip('"') in pooled else t for t in tokenize(line))
+
+		result.append(line)
+
+	return result
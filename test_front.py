@@ -0,0 +1,66 @@
+#encoding: utf-8
+
+import pytest
+
+import front
+from front import IncrementalParser, TypeMismatch, compile_source
+
+SOURCE = """
+fn double(a: num) -> num { a * 2 }
+fn triple(a: num) -> num { a * 3 }
+q: num = 4;
+r: *num = *q;
+Disp(double(q) + triple(q));
+"""
+
+def test_recompiling_an_edited_source_only_parses_the_changed_items():
+
+	parser = IncrementalParser()
+	compile_source(SOURCE, parser=parser)
+	assert (parser.parsed, parser.reused) == (5, 0)
+
+	compile_source(SOURCE.replace("a * 3", "a * 4"), parser=parser)
+	assert (parser.parsed, parser.reused) == (1, 4)
+
+def test_compile_source_keeps_the_parser_of_each_file():
+
+	compile_source(SOURCE, filename="kept.hn")
+	compile_source(SOURCE.replace("a * 3", "a * 4"), filename="kept.hn")
+	assert front._parsers["kept.hn"].reused == 4
+
+def test_declarations_store_their_initial_value_once():
+
+	# ⌊RAM slots were cleared before being set
+	main = compile_source("q: num = 4;\nr: *num = *q;\nl: long = 5;\nDisp(q + l);")["MAIN"].split("\n")
+	assert "4→⌊RAM(1)" in main and not any(line.startswith("0→⌊RAM(") for line in main)
+
+def test_a_trait_method_cannot_reuse_the_name_of_an_inherent_method():
+
+	source = """
+struct P { x: num }
+trait Norm { fn norm(self: &Self) -> num; }
+impl P { fn norm(self: &Self) -> num { self.x } }
+impl Norm for P { fn norm(self: &Self) -> num { self.x * 2 } }
+"""
+
+	with pytest.raises(TypeMismatch, match="already has a method norm"):
+		compile_source(source, parser=IncrementalParser())
+
+@pytest.mark.parametrize("source", [
+	'x: num = 1;\nif true { x = "abc"; }',
+	'if true { y: num = 1; y = "abc"; Disp(y); }',
+])
+def test_code_run_at_compile_time_is_still_type_checked(source: str):
+
+	with pytest.raises(TypeMismatch, match="expected num, found string"):
+		compile_source(source, parser=IncrementalParser())
+
+@pytest.mark.parametrize("source", [
+	"x: num = 0.1 + 0.2; c: num = 0; if x == 0.3 { c = 1; } Disp(c);",
+	"x: num = 0; for (i, 1, 10) { x += 0.1; } c: num = 0; if x == 1 { c = 1; } Disp(c);",
+])
+def test_code_run_at_compile_time_computes_in_decimal_like_the_calculator(source: str):
+
+	# binary floats left 0.30000000000000004 and 0.9999999999999999, so c stayed 0
+	main = compile_source(source, parser=IncrementalParser())["MAIN"].split("\n")
+	assert main[-2:] == ["1", "Disp Rep"]
@@ -0,0 +1,150 @@
+#encoding: utf-8
+
+import random
+import re
+
+import pytest
+
+from abi import ARG_WINDOW, ARG_WINDOW_START, RAM_WORDS
+from heap import (
+	ADR, CLASS_CAPS, CLASS_HEADS, CLASS_OF_SIZE, COMPACT_READ, DAT, HANDLES, HEADER, HEAP_WORDS, LARGE_HEAD, MAX_SMALL,
+	SIZE_CLASSES, STATE, STATE_WORDS, STEP_WORDS, TOP, Heap, class_of_size, program_alloc, program_defrag_step, program_free,
+	program_init, runtime_programs,
+)
+
+def test_init_dimensions_ram_past_the_argument_window():
+	assert f"{RAM_WORDS}→dim(⌊RAM)" in program_init().split("\n")
+	assert ARG_WINDOW_START + ARG_WINDOW - 1 == RAM_WORDS
+
+def test_a_freed_block_is_reused_by_the_next_block_of_its_class():
+
+	heap = Heap()
+	a = heap.alloc([1, 2, 3])
+	b = heap.alloc([4, 5, 6])
+	heap.alloc([7])
+	base_a, base_b, top = heap.base(a), heap.base(b), heap.state[TOP]
+
+	heap.free(a)
+	heap.free(b)
+
+	# the free list of a class is popped from its head, the last block freed comes first
+	assert heap.base(heap.alloc([8, 9, 10])) == base_b
+	assert heap.base(heap.alloc([10, 11, 12])) == base_a
+	assert heap.state[TOP] == top
+
+	# another class is not served from it
+	heap.free(heap.alloc([1]*4))
+	heap.alloc([1]*5)
+	assert heap.state[TOP] > top
+
+def test_a_large_block_takes_the_first_free_block_big_enough():
+
+	heap = Heap()
+	small = heap.alloc([0]*20)
+	heap.alloc([1])
+	big = heap.alloc([0]*40)
+	heap.alloc([1])
+	base_small, base_big = heap.base(small), heap.base(big)
+
+	heap.free(big)
+	heap.free(small)
+
+	# the 20 words block heads the list but is too small
+	taken = heap.alloc([0]*25)
+	assert heap.base(taken) == base_big
+	assert heap.dat[base_big - 1] == -40
+	assert heap.state[LARGE_HEAD] == base_small
+
+	# the block keeps its capacity when freed again
+	heap.free(taken)
+	assert heap.base(heap.alloc([0]*40)) == base_big
+
+def test_freed_handles_are_recycled_and_invalid_until_then():
+
+	heap = Heap()
+	a = heap.alloc([1])
+	b = heap.alloc([2])
+	heap.free(a)
+	heap.free(b)
+
+	with pytest.raises(Heap.InvalidHandle):
+		heap.read(a, 0)
+
+	assert [heap.alloc([3]), heap.alloc([4]), heap.alloc([5])] == [b, a, 3]
+	assert heap.read(a, 0) == 4
+
+def test_allocating_past_the_heap_fails():
+
+	heap = Heap()
+	heap.alloc_vec(HEAP_WORDS - HEADER)
+	assert heap.used_words() == HEAP_WORDS
+
+	with pytest.raises(Heap.OutOfMemory):
+		heap.alloc([1])
+
+def test_generated_programs_use_the_layout_of_the_model():
+
+	init = program_init().split("\n")
+	assert f"{HEAP_WORDS}→dim({DAT})" in init
+	assert f"{HANDLES}→dim({ADR})" in init
+	assert f"{STATE_WORDS}→dim({STATE})" in init
+	assert "{" + ",".join(map(str, SIZE_CLASSES)) + f"→{CLASS_CAPS}" in init
+	assert "{" + ",".join(str(class_of_size(n)) for n in range(1, MAX_SMALL + 1)) + f"→{CLASS_OF_SIZE}" in init
+
+	alloc = program_alloc()
+	assert f">{HEAP_WORDS}: Then" in alloc and f">{HANDLES}: Then" in alloc
+	assert f"≤{MAX_SMALL}: Then" in alloc
+	assert f"{STATE}({CLASS_HEADS - 1}+" in alloc and f"{STATE}({CLASS_HEADS - 1}+" in program_free()
+	assert f"{STATE}({TOP})+{HEADER}" in alloc and f"-{HEADER})" in alloc
+
+	# every state word the programs touch was dimensioned
+	for source in runtime_programs().values():
+		assert all(1 <= int(i) <= STATE_WORDS for i in re.findall(rf"{STATE}\((\d+)\)", source))
+
+def test_incremental_compaction_keeps_blocks_allocated_and_freed_between_steps():
+
+	rng = random.Random(0)
+	heap = Heap()
+	live: dict[int, list[int]] = {}
+
+	def alloc():
+		values = [rng.randrange(1000) for _ in range(rng.randint(1, 30))]
+		live[heap.alloc(values)] = values
+
+	def free():
+		heap.free(handle := rng.choice(list(live)))
+		del live[handle]
+
+	for _ in range(40):
+		alloc()
+
+	for _ in range(15):
+		free()
+
+	heap.begin_defrag()
+	steps = 0
+
+	while heap.compacting():
+
+		# a step never scans past the budget by more than the block it stopped in, of 30 words at most
+		assert heap.defrag_step() < STEP_WORDS + HEADER + 30
+
+		rng.choice((alloc, free))()
+		steps += 1
+
+		for handle, values in live.items():
+			assert [heap.read(handle, i) for i in range(len(values))] == values
+
+	assert steps > 1
+
+def test_a_compaction_step_stops_at_the_first_block_past_its_budget():
+
+	heap = Heap()
+	handles = [heap.alloc([n]*16) for n in range(10)]
+	heap.free(handles[0])
+	heap.begin_defrag()
+
+	# 18 words per block, the step stops once 48 were scanned
+	assert heap.defrag_step() == 3*(HEADER + 16)
+	assert heap.state[COMPACT_READ] == 1 + 3*(HEADER + 16)
+	assert any(line.startswith("While ") and line.endswith(f"<{STEP_WORDS}") for line in program_defrag_step().split("\n"))
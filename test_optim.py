@@ -0,0 +1,101 @@
+#encoding: utf-8
+
+import trans
+from optim import cache_loop_members, pool_strings, promote_local_structs, reuse_ans, unroll_loops
+from trans import Array, Const, Disp, Scope, SmallVar, StructInstance, While, new_locator
+
+# a struct of two members, 1 and 2, in A
+ALLOC = ["2→X", "1→⌊RAM(968)", "2→⌊RAM(969)", "prgmHNALLOC", "Rep→A"]
+FREE = ["A→X", "prgmHNFREE"]
+
+def test_reuse_ans_keeps_stores_a_callee_reads_through_a_pointer():
+	# a runtime program reads ⌊RAM(Rep) and may land on the stored slot
+	lines = ["5→⌊RAM(1)", "⌊RAM(1)+1→A", "prgmGET", "Disp A"]
+	assert reuse_ans(lines, []) == lines
+
+def test_reuse_ans_keeps_stores_to_argument_registers():
+	lines = ["5→X", "X+1→A", "prgmGET", "Disp A"]
+	assert reuse_ans(lines, []) == lines
+
+def test_reuse_ans_folds_letters_a_callee_does_not_read():
+	assert reuse_ans(["5→B", "B+1→A", "prgmGET", "Disp A"], []) == ["5", "Rep+1→A", "prgmGET", "Disp A"]
+
+def test_pool_strings_does_not_load_between_a_value_and_its_read_of_ans():
+	lines = ["prgmHNALLOC", 'Rep+length("hello there")→A', 'Disp "hello there"', 'Disp "hello there"', 'Disp "hello there"']
+	assert pool_strings(lines, ["Chn1"]) == lines
+
+def test_unroll_loops_folds_the_substituted_values():
+	lines = ["For(B,0,2", "A+B*⌊RAM(1)→A", "B+1→⌊DAT(⌊ADR(C)+B)", "End"]
+	assert unroll_loops(lines, []) == [
+		"1→⌊DAT(⌊ADR(C)+0)", "A+⌊RAM(1)→A", "2→⌊DAT(⌊ADR(C)+1)", "A+2*⌊RAM(1)→A", "3→⌊DAT(⌊ADR(C)+2)",
+	]
+
+def test_reuse_ans_keeps_stores_a_computed_index_may_read():
+	assert reuse_ans(["5→⌊RAM(3)", "⌊RAM(B)+1→A", "Disp A"], [])[0] == "5→⌊RAM(3)"
+
+def test_reuse_ans_keeps_array_stores_read_at_a_computed_index():
+
+	new_locator()
+	i = SmallVar()
+	i.set(Const(2))
+	arr = Array(Const(3))
+	arr[Const(2)].set(Const(5))
+	Disp(arr[i])
+
+	assert "5→⌊RAM(3)" in trans.Locator.target_code.compute_output().split("\n")
+
+def test_unrolled_struct_copies_are_still_promoted():
+
+	new_locator()
+
+	with Scope():
+
+		s = StructInstance((("x", Const(1)), ("y", Const(2))))
+
+		with Scope():
+			Disp(s.clone().get_member("x"))
+
+	code = trans.Locator.target_code
+	code.passes = [unroll_loops, promote_local_structs]
+	assert code.compute_output().split("\n") == ["1→D", "2→E", "0→F", "0→G", "D→F", "E→G", "Disp F"]
+
+def test_promote_local_structs_puts_the_members_in_spares():
+	lines = ALLOC + ["Disp ⌊DAT(⌊ADR(A)+0)+⌊DAT(⌊ADR(A)+1)"] + FREE + ["Disp 1"]
+	assert promote_local_structs(lines, ["B", "C"]) == ["1→B", "2→C", "Disp B+C", "Disp 1"]
+
+def test_promote_local_structs_keeps_a_handle_used_bare():
+	# the copy of the handle may outlive the block
+	lines = ALLOC + ["A→B", "Disp ⌊DAT(⌊ADR(A)+0)"] + FREE
+	assert promote_local_structs(lines, ["C", "D"]) == lines
+
+def test_cache_loop_members_writes_back_the_members_stored_in_the_loop():
+
+	lines = ALLOC + ["While ⌊DAT(⌊ADR(A)+0)<10", "⌊DAT(⌊ADR(A)+0)+⌊DAT(⌊ADR(A)+1)→⌊DAT(⌊ADR(A)+0)", "End", "Disp ⌊DAT(⌊ADR(A)+0)"]
+	assert cache_loop_members(lines, ["B", "C"]) == ALLOC + [
+		"⌊DAT(⌊ADR(A)+0)→B", "⌊DAT(⌊ADR(A)+1)→C", "While B<10", "B+C→B", "End", "B→⌊DAT(⌊ADR(A)+0)", "Disp ⌊DAT(⌊ADR(A)+0)",
+	]
+
+def test_cache_loop_members_leaves_loops_calling_a_user_program():
+	# the program may read or write the members through its own copy of the handle
+	lines = ALLOC + ["While ⌊DAT(⌊ADR(A)+0)<10", "⌊DAT(⌊ADR(A)+0)+1→⌊DAT(⌊ADR(A)+0)", "prgmUSER", "End"]
+	assert cache_loop_members(lines, ["B", "C"]) == lines
+
+def test_a_costly_et_chain_is_tested_through_a_flag_cheapest_first():
+
+	new_locator()
+	a = SmallVar()
+	a.set(Const(0))
+	arr = Array(Const(5))
+
+	with While((arr[a] * arr[a] + arr[a] * Const(3) > Const(7)) & (a < Const(10))):
+		a.set(a + Const(1))
+
+	with While((a < Const(10)) & (a > Const(2))):
+		a.set(a + Const(1))
+
+	trans.Locator.target_code.passes = []
+	lines = trans.Locator.target_code.compute_output().split("\n")
+	# the list lookups are only made when A<10 holds, again before each back edge
+	test = ["A<10→B", "If B", "⌊RAM(1+A)²+⌊RAM(1+A)*3>7→B"]
+
+	assert lines[4:] == [*test, "While B", "A+1→A", *test, "End", "While A<10 et A>2", "A+1→A", "End"]
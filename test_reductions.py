@@ -0,0 +1,132 @@
+#encoding: utf-8
+
+import random
+from decimal import ROUND_DOWN, Decimal, localcontext
+from typing import Callable
+
+import pytest
+
+from optim import tokenize
+from trans import (
+	TI_CONTEXT, Addition, BinLogicOp, Const, Division, ExprRoot, FracPart, IntPart, Multiplication, Neg, Not, NumRaw, NumVal,
+	Paren, Square, Substraction, Var, get_num_val, intpart
+)
+
+# Compares random expressions with the text the code generator emits for them,
+# both computed in the 14 digits the calculator works with.
+
+def _trunc(a: Decimal) -> Decimal:
+	return a.to_integral_value(rounding=ROUND_DOWN)
+
+# what the operations compute, for checking the reductions
+_SEMANTICS: dict[type, Callable[..., Decimal]] = {
+	Addition: lambda a, b: a + b,
+	Substraction: lambda a, b: a - b,
+	Multiplication: lambda a, b: a * b,
+	Division: lambda a, b: a / b,
+	Neg: lambda a: -a,
+	Not: lambda a: Decimal(a == 0),
+	IntPart: _trunc,
+	FracPart: lambda a: a - _trunc(a),
+	Square: lambda a: a * a,
+}
+
+_COMPARISONS: dict[str, Callable[[Decimal, Decimal], bool]] = {
+	"=": lambda a, b: a == b, "≠": lambda a, b: a != b,
+	"<": lambda a, b: a < b, ">": lambda a, b: a > b,
+	"≤": lambda a, b: a <= b, "≥": lambda a, b: a >= b,
+}
+
+# how the calculator reads the tokens, as python
+_PYTHON_TOKENS: dict[str, str] = {
+	"⁻": "-", "²": "**2", "=": "==", "≠": "!=", "≤": "<=", "≥": ">=",
+	"partEnt(": "_trunc(", "partDéc(": "_frac(", "non(": "_not(",
+}
+
+def evaluate(expr: NumVal, env: dict[str, Decimal]) -> Decimal:
+	"""computes an expression tree in the current decimal context, its variables being read from env"""
+
+	if isinstance(expr, (Paren, ExprRoot)):
+		return evaluate(expr.child, env)
+
+	if isinstance(expr, Const):
+		return +Decimal(expr.val)
+
+	if isinstance(expr, Var):
+		return env[expr.val]
+
+	operands = (evaluate(op, env) for op in expr.operands)
+
+	if isinstance(expr, BinLogicOp):
+		return Decimal(_COMPARISONS[expr.symbol](*operands))
+
+	return _SEMANTICS[type(expr)](*operands)
+
+def run_text(text: str, env: dict[str, Decimal]) -> Decimal:
+	"""computes the text of an expression in the current decimal context, as the calculator would"""
+
+	tokens = (f"_D('{t.replace('ᴇ⁻', 'e-').replace('ᴇ', 'e')}')" if t[0] in "0123456789.ᴇ" else _PYTHON_TOKENS.get(t, t) for t in tokenize(text))
+	scope = {"_D": Decimal, "_trunc": _trunc, "_frac": _SEMANTICS[FracPart], "_not": _SEMANTICS[Not], **env}
+	return Decimal(eval("".join(tokens), {"__builtins__": {}}, scope))
+
+def random_expr(rng: random.Random, names: list[str], depth: int) -> NumVal:
+	"""builds an expression the way the operators of NumOp do, with the shapes the rules look for"""
+
+	if depth == 0 or rng.random() < 0.2:
+		return NumRaw(rng.choice(names)) if rng.random() < 0.6 else Const(rng.choice(("0", "1", "2", "3", "0.5", "1.1", "10")))
+
+	a, b = random_expr(rng, names, depth - 1), random_expr(rng, names, depth - 1)
+	shape = rng.randrange(10)
+
+	if shape == 0: return Neg(a)
+	if shape == 1: return Paren(IntPart(a))
+	if shape == 2: return a * Const(2)
+	if shape == 3: return a * a
+	if shape == 4: return a * Const(1.1) * Const(1.1)
+	if shape == 5: return a - intpart(a)
+	return rng.choice((Addition, Substraction, Multiplication, Division))(a, Paren(b)) if rng.random() < 0.3 else rng.choice((a + b, a - b, a * b, a / b))
+
+def _check_one(rng: random.Random, names: list[str]):
+
+	expr = random_expr(rng, names, 4)
+
+	if rng.random() < 0.3:
+
+		n, d = random_expr(rng, names, 2), NumRaw(rng.choice(names))
+		expr = rng.choice((intpart(n) == n, intpart(n / d) * d == n, n == intpart(n / d) * d))
+
+	try:
+		text = get_num_val(expr)
+
+	# the simplifier refuses divisions by a zero constant
+	except ValueError:
+		return
+
+	for _ in range(8):
+
+		env = {name: Decimal(rng.randint(-40, 40)) / rng.choice((1, 2)) for name in names}
+
+		try:
+			expected = evaluate(expr, env)
+
+		except ArithmeticError:
+			continue
+
+		try:
+			got = run_text(text, env)
+
+		except ArithmeticError:
+			got = None
+
+		if got is None or abs(got - expected) > Decimal("1e-9") * max(1, abs(expected)):
+			raise AssertionError(f"{text} gives {got} instead of {expected} for {env}")
+
+@pytest.mark.parametrize("seed", range(10))
+def test_reductions_keep_the_value(seed: int):
+
+	rng = random.Random(seed)
+	names = ["A", "B", "C"]
+
+	with localcontext(TI_CONTEXT):
+		for _ in range(1000):
+			_check_one(rng, names)
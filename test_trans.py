@@ -0,0 +1,80 @@
+#encoding: utf-8
+
+import trans
+from trans import Const, If, Scope, SmallVar, Vector, While, new_locator
+
+def test_break_frees_each_vector_once_on_every_path():
+
+	new_locator()
+	a = SmallVar()
+	a.set(Const(0))
+
+	with While(a < Const(10)) as w:
+
+		Vector(Const(2))
+
+		with If(a == Const(5)):
+			Vector(Const(3))
+			w.Break()
+			# never runs, so never allocated
+			Vector(Const(1))
+
+		# only allocated if the loop goes on
+		Vector(Const(4))
+		a.set(a + Const(1))
+
+	trans.Locator.target_code.passes = []
+	lines = trans.Locator.target_code.compute_output().split("\n")
+	guard = lines.index("If non(B): Then")
+	guarded = lines[guard:lines.index("End", guard)]
+
+	assert lines.count("prgmHNALLVEC") == lines.count("prgmHNFREE") == 3
+	assert guarded.count("prgmHNALLVEC") == guarded.count("prgmHNFREE") == 1
+
+def test_break_flag_is_freed_for_later_loops_but_kept_off_the_loop_variables():
+
+	new_locator()
+	a = SmallVar()
+	a.set(Const(0))
+
+	for _ in range(2):
+
+		with While(a < Const(10)) as w:
+
+			with Scope():
+				# freed before the break, yet live in every iteration
+				t = SmallVar()
+				t.set(a + Const(1))
+				a.set(t)
+
+			with If(a == Const(5)):
+				w.Break()
+
+	trans.Locator.target_code.passes = []
+	lines = trans.Locator.target_code.compute_output().split("\n")
+	flags = [line[len("0→"):] for line in lines if line.startswith("0→") and line != "0→A"]
+
+	assert flags == ["C", "C"]
+	assert trans.Locator.small_vars.untouched()[0] == "D"
+
+def test_back_edges_run_a_compaction_step_when_one_is_in_progress():
+
+	new_locator()
+	trans.Locator.defrag_at_back_edges = True
+	a = SmallVar()
+	a.set(Const(0))
+
+	with While(a < Const(10)):
+
+		a.set(a + Const(1))
+
+		with While(a < Const(5)):
+			a.set(a + Const(2))
+
+	trans.Locator.target_code.passes = []
+	lines = trans.Locator.target_code.compute_output().split("\n")
+	# a one line If guards the step, the End after it closes the loop
+	step = ["If ⌊HNS(4)", "prgmHNDEFST"]
+
+	assert lines[-7:] == ["A+2→A", *step, "End", *step, "End"]
+	assert lines.count("While A<10") == lines.count("While A<5") == 1
@@ -2,8 +2,11 @@
 
 from __future__ import annotations
 import sys
+from copy import copy
 from dataclasses import dataclass
+from decimal import Context, Decimal, InvalidOperation
 from enum import Enum
+from itertools import count
 from io import TextIOWrapper
 from math import gcd
 
@@ -12,6 +15,10 @@ from traceback import TracebackException
 from types import TracebackType
 from typing import Any, Callable, Tuple, Type, Union
 
+from abi import ARG_REGS, ARG_WINDOW_START, RUNTIME_ABIS, Abi
+from heap import COMPACT_READ, STATE
+from optim import Pass, cache_loop_members, pool_strings, promote_local_structs, reuse_ans, tokenize, unroll_loops, used_names
+
 ASS = "→"
 L = "⌊"
 
@@ -35,6 +42,9 @@ class VarPlanner:
 		self._name: str = name
 		self._space: list[str] = space
 		self._allocated: set[str] = set()
+		self._touched: set[str] = set()
+		# every allocation in order, for telling what a stretch of code used
+		self._history: list[str] = []
 
 	def get(self) -> str:
 		"""returns an available element"""
@@ -52,12 +62,38 @@ class VarPlanner:
 			raise self.ForeignElement(f"{e} is not in the space of {self._name} and therefore cannot be allocated by it")
 
 		self._allocated.add(e)
+		self._touched.add(e)
+		self._history.append(e)
 		return e
 
 	def get_allocated(self) -> str:
 		"""returns an allocated element"""
 		return self.alloc(self.get())
 
+	def untouched(self) -> list[str]:
+		"""returns the elements that were never allocated"""
+		return [e for e in self._space if e not in self._touched]
+
+	def touched(self) -> set[str]:
+		"""returns the elements that were allocated at least once"""
+		return set(self._touched)
+
+	def position(self) -> int:
+		"""returns the current position in the allocation history"""
+		return len(self._history)
+
+	def unused_since(self, position: int) -> list[str]:
+		"""returns the elements neither allocated now nor since position"""
+
+		used = self._allocated.union(self._history[position:])
+		return [e for e in self._space if e not in used]
+
+	def reserve(self, elements: set[str]):
+		"""marks the elements as unavailable for good"""
+
+		for e in elements:
+			self.alloc(e)
+
 	def free(self, e: str):
 		"""marks an element as available"""
 
@@ -70,48 +106,197 @@ class VarPlanner:
 		except KeyError as err:
 			raise self.UnalocatedElement(f"{e} is not allocated in {self._name} and therefore cannot be freed from it") from err
 
+class Mark:
+	"""a position in the emitted code, kept in place when lines are inserted or deleted before it"""
+
+	def __init__(self, index: int):
+
+		self.index: int = index
+
 class TargetCode:
 
 	def __init__(self):
 
 		self._lines: list[str] = []
+		self._marks: list[Mark] = []
+		# string loads change Ans, they are placed before reuse_ans keeps values in it
+		self.passes: list[Pass] = [unroll_loops, promote_local_structs, cache_loop_members, pool_strings, reuse_ans]
+		# spare variables the passes used, other programs must not touch them
+		self.claimed: set[str] = set()
 
 	def write_ln(self, txt: str):
 		self._lines.append(txt)
 
+	def mark(self) -> Mark:
+		"""marks where the next line will be written"""
+
+		mark = Mark(len(self._lines))
+		self._marks.append(mark)
+		return mark
+
+	def release(self, mark: Mark or None):
+
+		if mark is not None:
+			self._marks.remove(mark)
+
+	def insert(self, index: int, lines: list[str]):
+
+		self._lines[index:index] = lines
+
+		for mark in self._marks:
+			if mark.index >= index:
+				mark.index += len(lines)
+
+	def delete(self, start: int, end: int):
+
+		del self._lines[start:end]
+
+		for mark in self._marks:
+			if mark.index > start:
+				mark.index = max(mark.index - (end - start), start)
+
+	def rewrite(self, index: int, line: str):
+		self._lines[index] = line
+
+	def __len__(self) -> int:
+		return len(self._lines)
+
 	def compute_output(self) -> str:
-		return "\n".join(self._lines)
+
+		lines = self._lines
+		spares = Locator.spare_vars(self)
+
+		for p in self.passes:
+			lines = p(lines, spares)
+
+		self.claimed = used_names(lines).intersection(spares)
+		return "\n".join(lines)
 
 	def output(self, file: TextIOWrapper):
 		file.write(self.compute_output())
 
+@dataclass
+class FileContext:
+	filename: str
+	line_nbr: int
+
+	def __str__(self) -> str:
+		return f"{self.filename}@{str(self.line_nbr)}"
+
+class Scope:
+	"""owns the variables created while it is the innermost scope, and frees them when it closes"""
+
+	def __init__(self):
+
+		self._owned: list[BaseVar] = []
+
+	def own(self, var: BaseVar):
+		self._owned.append(var)
+
+	def __len__(self) -> int:
+		return len(self._owned)
+
+	def close(self, keep: int = 0):
+		"""frees the owned variables but the first keep, last created first"""
+
+		while len(self._owned) > keep:
+			self._owned.pop().free()
+
+	def __enter__(self) -> Scope:
+		Locator.scopes.append(self)
+		return self
+
+	def __exit__(self, *args, **kwargs):
+		Locator.scopes.remove(self)
+		self.close()
+
 class BaseLocator:
 
 	def __init__(self):
 
-		self.small_vars = VarPlanner("small vars", list(ascii_uppercase))
-		self.med_vars = VarPlanner("med vars", list(str(n) for n in range(1, 999 + 1)))
+		self.small_vars = VarPlanner("small vars", list(c for c in ascii_uppercase if c not in ARG_REGS))
+		self.med_vars = VarPlanner("med vars", list(str(n) for n in range(1, ARG_WINDOW_START)))
 		self.string_vars = VarPlanner("string vars", list(f"Chn{str(n)}" for n in range(9 + 1)))
 		self.target_code = TargetCode()
 		self.file_context: FileContext = FileContext("?", 0)
+		self.defrag_at_back_edges: bool = False
+		self.abis: dict[str, Abi] = dict(RUNTIME_ABIS)
+		self.scopes: list[Scope] = [Scope()]
+		# the control flow blocks being emitted, innermost last
+		self.blocks: list[ControlFlow] = []
+		self.programs: dict[str, TargetCode] = {}
 
 	def set_file_context(self, file_context: FileContext):
 		self.file_context = file_context
 
+	def own(self, var: BaseVar):
+		"""hands var to the innermost scope"""
+		self.scopes[-1].own(var)
+
+	def declare_abi(self, abi: Abi):
+		"""makes every later call to abi.name pass its arguments through registers"""
+		self.abis[abi.name] = abi
+
+	def spare_vars(self, code: TargetCode) -> list[str]:
+		"""returns the variables no program used, fastest first and strings last, minus those claimed by programs other than code"""
+
+		claimed = set().union(*(c.claimed for c in (self.target_code, *self.programs.values()) if c is not code))
+		spares = self.small_vars.untouched() + [f"⌊RAM({e})" for e in self.med_vars.untouched()] + self.string_vars.untouched()
+		return [e for e in spares if e not in claimed]
+
 Locator = BaseLocator()
 
-class BaseVar: ...
+def new_locator() -> BaseLocator:
+	"""starts over with a fresh locator, for compiling several programs in one run"""
+
+	global Locator
+	Locator = BaseLocator()
+	return Locator
+
+class Subprogram:
+	"""redirects the emitted code to the program called name while it is entered"""
+
+	def __init__(self, name: str):
+
+		self._name: str = name
+		self._outer: TargetCode or None = None
+
+	def __enter__(self) -> Subprogram:
+
+		self._outer = Locator.target_code
+		Locator.target_code = Locator.programs.setdefault(self._name, TargetCode())
+		return self
+
+	def __exit__(self, *args, **kwargs):
+		Locator.target_code = self._outer
+
+class BaseVar:
+
+	__slots__ = ()
+
+	def free(self):
+		"""releases what the variable holds, freeing twice does nothing"""
 
 class String(BaseVar):
 
 	def __init__(self) -> None:
 
-		self._val: str = Locator.string_vars.get()
-		Locator.string_vars.alloc(self._val)
+		self._val: str = Locator.string_vars.get_allocated()
+		self._freed: bool = False
+		Locator.own(self)
 
 	def __str__(self) -> str:
 		return self._val
 
+	def free(self):
+
+		if not self._freed:
+			self._freed = True
+			Locator.string_vars.free(self._val)
+
+	def set(self, val: String or StringConst or StringRaw):
+		wraw(f"{val.val}{ASS}{self._val}")
+
 	@property
 	def val(self) -> str:
 		return self._val
@@ -129,8 +314,25 @@ class StringConst(BaseVar):
 	def val(self) -> str:
 		return '"' + self._text + '"'
 
+class StringRaw(BaseVar):
+
+	def __init__(self, text: str):
+
+		self._text = text
+
+	def __str__(self) -> str:
+		return self.val
+
+	@property
+	def val(self) -> str:
+		return self._text
+
+StringVal = Union[String, StringConst, StringRaw]
+
 class Var(BaseVar):
 
+	__slots__ = ()
+
 	@property
 	def addr(self) -> str: ...
 
@@ -149,7 +351,7 @@ class Var(BaseVar):
 	def decr(self):
 		self.set(self - Const(1))
 
-	def simplified(self, ctx: list[NumOp]) -> NumVal:
+	def simplified(self, parent: NumOp) -> NumVal:
 		return self
 
 	def __add__(self, other) -> Paren:
@@ -232,8 +434,10 @@ def deref(var: Var) -> Union[MedVar, StructInstance, StructMember]:
 NumVal = Union[Var, "NumOp"]
 
 class NumOp:
+
+	__slots__ = ()
 	
-	def simplified(self, ctx: list[NumOp]) -> NumVal: ...
+	def simplified(self, parent: NumOp) -> NumVal: ...
 	
 	def __str__(self) -> str:
 		return self.val
@@ -241,6 +445,29 @@ class NumOp:
 	@property
 	def val(self) -> str: ...
 
+	@property
+	def operands(self) -> tuple[NumVal, ...]:
+
+		try:
+			return self._a, self._b
+
+		except AttributeError:
+			return self._a,
+
+	def rebuilt(self, *operands: NumVal) -> NumOp:
+		"""returns the same operation on other operands, or itself when they are the same"""
+
+		# nodes are never changed once built, unchanged subtrees are shared
+		if all(new is old for new, old in zip(operands, self.operands)):
+			return self
+
+		op = copy(self)
+
+		for name, operand in zip(("_a", "_b"), operands):
+			setattr(op, name, operand)
+
+		return op
+
 	def __add__(self, other) -> Paren:
 		return Paren(Addition(self, other))
 
@@ -282,37 +509,36 @@ class NumOp:
 
 class ExprRoot(NumOp):
 
+	__slots__ = ("_a",)
+
 	def __init__(self, a: NumVal):
 
 		self._a: NumVal = a
 
+	@property
+	def child(self) -> NumVal:
+		return self._a
+
 	def simplified_root(self) -> NumVal:
-		return self._a if isinstance(self._a, Var) else self._a.simplified([self])
+
+		simplified = self._a if isinstance(self._a, Var) else self._a.simplified(self)
+		return parenthesized(reduced(simplified))
 
 class Paren(NumOp):
 
+	__slots__ = ("_a",)
+
 	def __init__(self, a: NumVal):
 
 		self._a: NumVal = a
 
-	def simplified(self, ctx: list[NumOp]) -> NumVal:
-
-		a = self._a.simplified(ctx + [self])
-
-		if isinstance(a, Var):
-			return a
-
-		if isinstance(ctx[-1], Paren):
-			return a.simplified(ctx)
-
-		elif isinstance(a, (Multiplication, Division)) and isinstance(ctx[-1], (Addition, Substraction)):
-			return a.simplified(ctx)
-
-		elif isinstance(a, (Addition, Substraction)) and isinstance(ctx[-1], (Addition, Substraction)) or isinstance(a, (Multiplication, Division)) and isinstance(ctx[-1], (Multiplication, Division)):
-			return a.simplified(ctx)
+	def simplified(self, parent: NumOp) -> NumVal:
+		# parentheses are put back by precedence once the expression is reduced
+		return self._a.simplified(parent)
 
-		else:
-			return a.simplified(ctx) if isinstance(ctx[-1], ExprRoot) else Paren(a.simplified(ctx + [self]))
+	@property
+	def child(self) -> NumVal:
+		return self._a
 
 	@property
 	def val(self) -> str:
@@ -323,6 +549,8 @@ def pa(expr: NumVal) -> Paren:
 
 class BinLogicOp(NumOp):
 
+	__slots__ = ("_ti_sym", "_a", "_b")
+
 	def __init__(self, ti_sym: str, a: NumVal, b: NumVal):
 
 		self._ti_sym: str = ti_sym
@@ -333,23 +561,29 @@ class BinLogicOp(NumOp):
 	def val(self) -> str:
 		return f"{get_num_val(self._a)}{self._ti_sym}{get_num_val(self._b)}"
 
-	def simplified(self, ctx: list[NumOp]) -> NumVal:
-		return BinLogicOp(self._ti_sym, self._a.simplified(ctx + [self]), self._b.simplified(ctx + [self]))
+	@property
+	def symbol(self) -> str:
+		return self._ti_sym
+
+	def simplified(self, parent: NumOp) -> NumVal:
+		return BinLogicOp(self._ti_sym, self._a.simplified(self), self._b.simplified(self))
 
 class Neg(NumOp):
 
+	__slots__ = ("_a",)
+
 	def __init__(self, a: NumVal):
 
 		self._a: NumVal = a
 
-	def simplified(self, ctx: list[NumOp]) -> NumVal:
+	def simplified(self, parent: NumOp) -> NumVal:
 
-		a = self._a.simplified(ctx + [self])
+		a = self._a.simplified(self)
 
 		if isinstance(a, Neg):
 			
 			child = a.child
-			return child if isinstance(child, Var) else child.simplified(ctx)
+			return child if isinstance(child, Var) else child.simplified(parent)
 
 		return Neg(a)
 
@@ -359,22 +593,24 @@ class Neg(NumOp):
 
 	@property
 	def val(self) -> str:
-		return f"0-{self._a}"
+		return f"⁻{self._a}"
 
 class Not(NumOp):
 
+	__slots__ = ("_a",)
+
 	def __init__(self, a: NumVal):
 
 		self._a: NumVal = a
 
-	def simplified(self, ctx: list[NumOp]) -> NumVal:
+	def simplified(self, parent: NumOp) -> NumVal:
 
-		a = self._a.simplified(ctx + [self])
+		a = self._a.simplified(self)
 
 		if isinstance(a, Not):
 			
 			child = a.child
-			return child if isinstance(child, Var) else child.simplified(ctx)
+			return child if isinstance(child, Var) else child.simplified(parent)
 
 		return Not(a)
 
@@ -386,23 +622,82 @@ class Not(NumOp):
 	def val(self) -> str:
 		return f"non({self._a})"
 
+class IntPart(NumOp):
+
+	__slots__ = ("_a",)
+
+	def __init__(self, a: NumVal):
+
+		self._a: NumVal = a
+
+	def simplified(self, parent: NumOp) -> NumVal:
+		return IntPart(self._a.simplified(self))
+
+	@property
+	def child(self) -> NumVal:
+		return self._a
+
+	@property
+	def val(self) -> str:
+		return f"partEnt({self._a})"
+
+class FracPart(NumOp):
+
+	__slots__ = ("_a",)
+
+	def __init__(self, a: NumVal):
+
+		self._a: NumVal = a
+
+	def simplified(self, parent: NumOp) -> NumVal:
+		return FracPart(self._a.simplified(self))
+
+	@property
+	def child(self) -> NumVal:
+		return self._a
+
+	@property
+	def val(self) -> str:
+		return f"partDéc({self._a})"
+
+class Square(NumOp):
+
+	__slots__ = ("_a",)
+
+	def __init__(self, a: NumVal):
+
+		self._a: NumVal = a
+
+	def simplified(self, parent: NumOp) -> NumVal:
+		return Square(self._a.simplified(self))
+
+	@property
+	def child(self) -> NumVal:
+		return self._a
+
+	@property
+	def val(self) -> str:
+		return f"{self._a}²"
+
 class Addition(NumOp):
 
+	__slots__ = ("_a", "_b")
+
 	def __init__(self, a: NumVal, b: NumVal):
 
 		self._a = a
 		self._b = b
 
-	def simplified(self, ctx: list[NumOp]) -> NumVal:
+	def simplified(self, parent: NumOp) -> NumVal:
 
-		a = self._a.simplified(ctx + [self])
-		b = self._b.simplified(ctx + [self])
+		a = self._a.simplified(self)
+		b = self._b.simplified(self)
 
 		if a.val == "0": return b
 		if b.val == "0": return a
 
 		if isinstance(a, Const) and isinstance(b, Const):
-			return Const(eval(f"{a} + {b}"))
+			return number_const(TI_CONTEXT.add(number(a), number(b)))
 
 		return Addition(a, b)
 
@@ -412,21 +707,23 @@ class Addition(NumOp):
 
 class Substraction(NumOp):
 
+	__slots__ = ("_a", "_b")
+
 	def __init__(self, a: NumVal, b: NumVal):
 
 		self._a = a
 		self._b = b
 
-	def simplified(self, ctx: list[NumOp]) -> NumVal:
+	def simplified(self, parent: NumOp) -> NumVal:
 
-		a = self._a.simplified(ctx + [self])
-		b = self._b.simplified(ctx + [self])
+		a = self._a.simplified(self)
+		b = self._b.simplified(self)
 
-		if a.val == "0": return Neg(b).simplified(ctx)
+		if a.val == "0": return Neg(b).simplified(parent)
 		if b.val == "0": return a
 
 		if isinstance(a, Const) and isinstance(b, Const):
-			return Const(eval(f"{a} - {b}"))
+			return number_const(TI_CONTEXT.subtract(number(a), number(b)))
 
 		return Substraction(a, b)
 
@@ -436,22 +733,24 @@ class Substraction(NumOp):
 
 class Multiplication(NumOp):
 
+	__slots__ = ("_a", "_b")
+
 	def __init__(self, a: NumVal, b: NumVal):
 
 		self._a = a
 		self._b = b
 
-	def simplified(self, ctx: list[NumOp]) -> NumVal:
+	def simplified(self, parent: NumOp) -> NumVal:
 
-		a = self._a.simplified(ctx + [self])
-		b = self._b.simplified(ctx + [self])
+		a = self._a.simplified(self)
+		b = self._b.simplified(self)
 
 		if a.val == "0" or b.val == "0": return Const("0")
 		if a.val == "1": return b
 		if b.val == "1": return a
 
 		if isinstance(a, Const) and isinstance(b, Const):
-			return Const(eval(f"{a} * {b}"))
+			return number_const(TI_CONTEXT.multiply(number(a), number(b)))
 
 		return Multiplication(a, b)
 
@@ -461,15 +760,17 @@ class Multiplication(NumOp):
 
 class Division(NumOp):
 
+	__slots__ = ("_a", "_b")
+
 	def __init__(self, a: NumVal, b: NumVal):
 
 		self._a = a
 		self._b = b
 
-	def simplified(self, ctx: list[NumOp]) -> NumVal:
+	def simplified(self, parent: NumOp) -> NumVal:
 
-		a = self._a.simplified(ctx + [self])
-		b = self._b.simplified(ctx + [self])
+		a = self._a.simplified(self)
+		b = self._b.simplified(self)
 
 		if b.val == "0": raise ValueError("cannot divide by zero!")
 
@@ -483,10 +784,11 @@ class Division(NumOp):
 
 			if af.is_integer() and bf.is_integer():
 				if (n := gcd(int(af), int(bf))) > 1:
-					return Division(Const(int(af/n)), Const(int(bf/n)))
+					num, den = int(af/n), int(bf/n)
+					return Const(num) if den == 1 else Division(Const(num), Const(den))
 
 			elif max(num, den) < 100:
-				return Division(Const(num), Const(den))
+				return Const(num) if den == 1 else Division(Const(num), Const(den))
 
 		return Division(a, b)
 
@@ -499,6 +801,8 @@ def get_num_val(expr: NumVal) -> str:
 
 class Const(Var):
 
+	__slots__ = ("_val",)
+
 	class NoAddr(Exception): ...
 	class CannotSetConstant(Exception): ...
 
@@ -530,6 +834,8 @@ class Const(Var):
 
 class NumRaw(Var):
 
+	__slots__ = ("_text",)
+
 	class NoAddr(Exception): ...
 
 	def __init__(self, text: str):
@@ -544,13 +850,280 @@ class NumRaw(Var):
 	def val(self) -> str:
 		return self._text
 
+# Strength reduction: once simplified, an expression is rewritten bottom up by
+# the rules of REDUCTIONS, a rewrite being kept only when TOKEN_COSTS finds it
+# cheaper. Rules see operations without parentheses, which are put back where
+# the precedence of the calculator needs them.
+
+# rough evaluation times, tokens missing from the table cost 1 and numbers 1 per character
+TOKEN_COSTS: dict[str, int] = {
+	"+": 2, "-": 2, "⁻": 1, "*": 4, "/": 6, "²": 3,
+	"=": 2, "≠": 2, "<": 2, ">": 2, "≤": 2, "≥": 2, "et": 2, "ou": 2,
+	"partEnt(": 6, "partDéc(": 6, "non(": 2,
+}
+
+# list elements are read through a lookup
+LIST_COST = 8
+
+# the calculator computes with 14 significant digits
+TI_CONTEXT = Context(prec=14)
+
+Reduction = Callable[[NumOp], Union[NumVal, None]]
+REDUCTIONS: list[Reduction] = []
+
+def reduction(rule: Reduction) -> Reduction:
+	"""registers a rule, which returns a replacement of the operation or None"""
+
+	REDUCTIONS.append(rule)
+	return rule
+
+def cost(expr: NumVal) -> int:
+
+	total = 0
+
+	for token in tokenize(expr.val):
+
+		if token.isspace():
+			continue
+
+		if token in TOKEN_COSTS:
+			total += TOKEN_COSTS[token]
+
+		elif token.startswith(L):
+			total += LIST_COST
+
+		elif token[0] in "0123456789.ᴇ":
+			total += len(token)
+
+		else:
+			total += 1
+
+	return total
+
+def precedence(expr: NumVal) -> int:
+
+	if isinstance(expr, BinLogicOp):
+		return {" ou ": 0, " et ": 1}.get(expr.symbol, 2)
+
+	if isinstance(expr, (Addition, Substraction)): return 3
+	if isinstance(expr, (Multiplication, Division)): return 4
+	if isinstance(expr, Neg): return 5
+	if isinstance(expr, Square): return 6
+	return 7
+
+def operand_precedences(expr: NumOp) -> tuple[int, ...]:
+	"""returns the lowest precedence each operand can have without parentheses"""
+
+	if isinstance(expr, BinLogicOp):
+		return precedence(expr), precedence(expr) + 1
+
+	if isinstance(expr, (Addition, Substraction)): return 3, 4
+	if isinstance(expr, (Multiplication, Division)): return 4, 5
+	if isinstance(expr, Neg): return 5,
+	if isinstance(expr, Square): return 7,
+	return 0,
+
+def bare(expr: NumVal) -> NumVal:
+
+	while isinstance(expr, Paren):
+		expr = expr.child
+
+	return expr
+
+def parenthesized(expr: NumVal, lowest: int = 0) -> NumVal:
+	"""puts parentheses back in a bare expression, which appears where operations of precedence lowest can"""
+
+	if isinstance(expr, Var):
+		return expr
+
+	expr = expr.rebuilt(*(parenthesized(op, p) for op, p in zip(expr.operands, operand_precedences(expr))))
+	return expr if precedence(expr) >= lowest else Paren(expr)
+
+def reduced(expr: NumVal, lowest: int = 0) -> NumVal:
+	"""rewrites a simplified expression with the reduction rules, returns it without parentheses"""
+
+	expr = bare(expr)
+
+	if isinstance(expr, Const) and expr.val.startswith("-"):
+		return Neg(Const(expr.val[1:]))
+
+	if isinstance(expr, Var):
+		return expr
+
+	expr = expr.rebuilt(*(reduced(op, p) for op, p in zip(expr.operands, operand_precedences(expr))))
+	applied = True
+
+	while applied:
+
+		applied = False
+
+		for rule in REDUCTIONS:
+
+			candidate = rule(expr)
+
+			if candidate is not None and cost(parenthesized(candidate, lowest)) < cost(parenthesized(expr, lowest)):
+				expr, applied = candidate, True
+				break
+
+	return expr
+
+def number(expr: NumVal) -> Decimal or None:
+	"""returns the value of a constant, None for anything else"""
+
+	if isinstance(expr, Neg):
+		value = number(expr.child)
+		return None if value is None else -value
+
+	if not isinstance(expr, Const):
+		return None
+
+	try:
+		return Decimal(expr.val)
+
+	except InvalidOperation:
+		return None
+
+def number_const(value: Decimal) -> NumVal:
+
+	const = Const(f"{abs(value).normalize():f}")
+	return Neg(const) if value < 0 else const
+
+@reduction
+def double(expr: NumOp) -> NumVal or None:
+	"""x*2 → x+x"""
+
+	if isinstance(expr, Multiplication):
+
+		a, b = expr.operands
+
+		if number(b) == 2: return Addition(a, a)
+		if number(a) == 2: return Addition(b, b)
+
+	return None
+
+@reduction
+def square(expr: NumOp) -> NumVal or None:
+	"""x*x → x²"""
+
+	if isinstance(expr, Multiplication):
+
+		a, b = expr.operands
+
+		if a.val == b.val:
+			return Square(a)
+
+	return None
+
+@reduction
+def scale(expr: NumOp) -> NumVal or None:
+	"""x*a*b → x*(a*b), x*a/b → x*(a/b), when a*b or a/b takes no rounding"""
+
+	if isinstance(expr, (Multiplication, Division)):
+
+		inner, b = expr.operands
+		b = number(b)
+
+		if isinstance(inner, Multiplication) and b is not None and b != 0:
+
+			x, a = inner.operands
+			a = number(a)
+
+			if a is None:
+				return None
+
+			if isinstance(expr, Multiplication):
+				factor = TI_CONTEXT.multiply(a, b)
+				exact = factor == a * b
+
+			else:
+				factor = TI_CONTEXT.divide(a, b)
+				exact = TI_CONTEXT.multiply(factor, b) == a
+
+			if exact:
+				return Multiplication(x, number_const(factor))
+
+	return None
+
+@reduction
+def negation(expr: NumOp) -> NumVal or None:
+	"""moves negations into the surrounding additions and products"""
+
+	if isinstance(expr, (Addition, Substraction)):
+
+		a, b = expr.operands
+
+		if isinstance(b, Neg):
+			return (Substraction if isinstance(expr, Addition) else Addition)(a, b.child)
+
+		if isinstance(expr, Addition) and isinstance(a, Neg):
+			return Substraction(b, a.child)
+
+	if isinstance(expr, (Multiplication, Division)):
+
+		a, b = expr.operands
+
+		if isinstance(a, Neg) and isinstance(b, Neg):
+			return expr.rebuilt(a.child, b.child)
+
+		if isinstance(expr, Multiplication) and number(b) == -1:
+			return Neg(a)
+
+	if isinstance(expr, Neg) and isinstance(expr.child, Substraction):
+
+		a, b = expr.child.operands
+		return Substraction(b, a)
+
+	if isinstance(expr, Neg) and isinstance(expr.child, (Multiplication, Division)):
+
+		a, b = expr.child.operands
+		return expr.child.rebuilt(Neg(a), b)
+
+	return None
+
+@reduction
+def fractional_part(expr: NumOp) -> NumVal or None:
+	"""x-partEnt(x) → partDéc(x)"""
+
+	if isinstance(expr, Substraction):
+
+		a, b = expr.operands
+
+		if isinstance(b, IntPart) and b.child.val == a.val:
+			return FracPart(a)
+
+	return None
+
+@reduction
+def divisibility(expr: NumOp) -> NumVal or None:
+	"""partEnt(x)=x → partDéc(x)=0, partEnt(n/d)*d=n → partDéc(n/d)=0"""
+
+	if not isinstance(expr, BinLogicOp) or expr.symbol not in ("=", "≠"):
+		return None
+
+	for whole, x in (expr.operands, expr.operands[::-1]):
+
+		if isinstance(whole, IntPart) and whole.child.val == x.val:
+			return BinLogicOp(expr.symbol, FracPart(x), Const(0))
+
+		if isinstance(whole, Multiplication) and isinstance(x, Var):
+
+			for part, d in (whole.operands, whole.operands[::-1]):
+
+				if isinstance(part, IntPart) and isinstance(ratio := part.child, Division) and ratio.operands[0].val == x.val and ratio.operands[1].val == d.val:
+					return BinLogicOp(expr.symbol, FracPart(ratio), Const(0))
+
+	return None
+
 class SmallVar(Var):
 
+	__slots__ = ("_ref_type", "_addr", "_freed")
+
 	def __init__(self, init_val: str = None, ref_type: RefType = (RefTypeUnit.no_ref,)):
 
 		self._ref_type: RefType = ref_type
-		self._addr: str = Locator.small_vars.get()
-		Locator.small_vars.alloc(self._addr)
+		self._addr: str = Locator.small_vars.get_allocated()
+		self._freed: bool = False
+		Locator.own(self)
 
 		if init_val is not None:
 			self.set(NumRaw(init_val))
@@ -567,20 +1140,28 @@ class SmallVar(Var):
 	def val(self) -> str:
 		return self._addr
 
-	def __del__(self):
-		Locator.small_vars.free(self._addr)
+	def free(self):
+
+		if not self._freed:
+			self._freed = True
+			Locator.small_vars.free(self._addr)
 
 	def clone(self) -> SmallVar:
 		return SmallVar(init_val=self.val, ref_type=self._ref_type)
 
 class MedVar(Var):
 
+	__slots__ = ("_ref_type", "_owned", "_addr")
+
 	def __init__(self, init_val: str = "0", addr: str or None = None, ref_type: RefType = (RefTypeUnit.no_ref,)):
 
 		self._ref_type: RefType = ref_type
+		# dereferences point to slots they don't own
+		self._owned: bool = addr is None
 
-		if addr is None:
+		if self._owned:
 			self._addr: str = Locator.med_vars.get_allocated()
+			Locator.own(self)
 			self.set(NumRaw(init_val))
 
 		else:
@@ -598,14 +1179,12 @@ class MedVar(Var):
 	def val(self) -> str:
 		return f"⌊RAM({self._addr})"
 
-	def __del__(self):
+	def free(self):
 
-		try:
+		if self._owned:
+			self._owned = False
 			Locator.med_vars.free(self._addr)
 
-		except VarPlanner.ForeignElement: # tried to free a dereference
-			pass # dereferences don't need special clean up
-
 	def ref(self) -> MedVar:
 		return MedVar(self._addr, ref_type=self._ref_type + (RefTypeUnit.med_var,))
 
@@ -617,6 +1196,8 @@ class MedVar(Var):
 
 class RamAccess(Var):
 
+	__slots__ = ("_ref_type", "_addr")
+
 	def __init__(self, addr: str, ref_type: RefType = (RefTypeUnit.no_ref,)):
 
 		self._ref_type: RefType = ref_type
@@ -645,6 +1226,8 @@ class RamAccess(Var):
 
 class StructMember(Var):
 
+	__slots__ = ("_ref_type", "_struct_addr", "_index")
+
 	def __init__(self, struct_addr: str, index: str, ref_type: RefType = (RefTypeUnit.no_ref,)):
 
 		self._ref_type = ref_type
@@ -669,32 +1252,54 @@ class StructMember(Var):
 	def small_ref(self) -> SmallVar:
 		return SmallVar(self.addr, self._ref_type + (RefTypeUnit.struct_member))
 
-def defrag_mem():
-	call("HNDEFRAG")
+def defrag_mem(incremental: bool = False):
+	"""compacts the heap, or only starts compacting it when incremental is set"""
+	call("HNDEFBG" if incremental else "HNDEFRAG")
+
+def safe_point():
+	"""runs a bounded compaction step if an incremental compaction is in progress"""
+
+	wraw(f"If {STATE}({COMPACT_READ})")
+	call("HNDEFST")
 
 def init_mem():
 	call("HNINIT")
 
+def alloc_mem(ret: Var, *vals: NumVal):
+	"""allocates a heap block holding vals, its handle is stored in ret"""
+
+	vals = vals or (Const(0),)
+	call("HNALLOC", ret, Const(len(vals)), *vals)
+
+def free_mem(handle: NumVal):
+	call("HNFREE", None, handle)
+
 class StructInstance(Var):
 
 	class CannotFindMember(Exception): ...
 
-	def __init__(self, init_vals: tuple[tuple[str, NumVal]] = None, addr: SmallVar or None = None):
+	def __init__(self, init_vals: tuple[tuple[str, NumVal]] = None, addr: SmallVar or None = None, owned: bool or None = None):
 
 		if init_vals is None: init_vals = {}
 
+		# instances built on an existing address are views on a block they don't own, unless told otherwise
+		self._owned: bool = addr is None if owned is None else owned
+
 		if addr is None:
 			self._addr = SmallVar()
-			call("HNALLOC", self._addr, *list(get_num_val(v) for _, v in init_vals))
+			alloc_mem(self._addr, *(v for _, v in init_vals))
 
 		else:
 			self._addr = addr
 
+		if self._owned:
+			Locator.own(self)
+
 		self._members: tuple[tuple[str, StructMember]] = tuple((k, StructMember(self._addr.val, str(n))) for n, (k, _) in enumerate(init_vals))
 
 	def clone(self) -> StructInstance:
 
-		clone = StructInstance({k: Const(0) for k in self._members})
+		clone = StructInstance(tuple((k, Const(0)) for k, _ in self._members))
 
 		with For(..., Const(0), Const(len(self._members) - 1)) as fl:
 			StructMember(clone.addr, fl.var.val).set(StructMember(self.addr, fl.var.val))
@@ -717,9 +1322,16 @@ class StructInstance(Var):
 	def val(self) -> str:
 		return f"⌊DAT{self.addr}"
 
-	def __del__(self):
-		Locator.target_code.write_ln(f"0{ASS}⌊ADR({self._addr.val}")
-		del self._addr
+	def free(self):
+
+		if self._owned:
+			self._owned = False
+			free_mem(self._addr)
+			self._addr.free()
+
+	def disown(self):
+		"""keeps the block alive past the scope owning the instance, to hand it to someone else"""
+		self._owned = False
 
 	def ref(self) -> MedVar:
 		return MedVar(self._addr.val, ref_type=(RefTypeUnit.no_ref, RefTypeUnit.struct_instance))
@@ -731,8 +1343,14 @@ def wraw(text: str):
 	Locator.target_code.write_ln(text)
 
 def call(name: str, ret: Var or None = None, *params: NumVal):
-	
-	if params:
+
+	abi = Locator.abis.get(name)
+
+	if abi is not None:
+		for n, param in enumerate(params):
+			wraw(f"{get_num_val(param)}{ASS}{abi.arg(n)}")
+
+	elif params:
 		if len(params) == 1:
 			wraw(get_num_val(params[0]))
 
@@ -744,6 +1362,72 @@ def call(name: str, ret: Var or None = None, *params: NumVal):
 	if ret is not None:
 		ret.set(NumRaw("Rep"))
 
+# evaluating a line costs this much besides its tokens
+LINE_COST = 2
+
+def chain(symbol: str, expr: NumVal) -> list[NumVal]:
+	"""returns the operands of a chain of symbol, like a, b and c for a et b et c"""
+
+	expr = bare(expr)
+
+	if isinstance(expr, BinLogicOp) and expr.symbol == symbol:
+		return chain(symbol, expr.operands[0]) + chain(symbol, expr.operands[1])
+
+	return [expr]
+
+def short_circuit(condition: NumVal) -> tuple[str, list[NumVal]] or None:
+	"""returns the operands of an et/ou condition cheapest first, when testing them one at a time pays off"""
+
+	condition = bare(condition)
+
+	if not isinstance(condition, BinLogicOp) or condition.symbol not in (" et ", " ou "):
+		return None
+
+	operands = sorted(chain(condition.symbol, condition), key=cost)
+	# each operand is taken to settle the condition half of the time
+	saved = sum(cost(op) * (1 - 0.5**n) for n, op in enumerate(operands))
+	# a store to the flag per operand, and a test of the flag before all but the first
+	added = (2 * len(operands) - 1) * (LINE_COST + 2)
+	return (condition.symbol, operands) if saved > added else None
+
+class Condition:
+	"""the test of a block, a costly et/ou chain being evaluated operand by operand into a flag"""
+
+	def __init__(self, condition: NumVal):
+
+		root = ExprRoot(condition).simplified_root()
+		split = short_circuit(root)
+		self._flag: str or None = None
+		self._lines: list[str] = []
+
+		if split is None:
+			self.test: str = root.val
+			return
+
+		symbol, operands = split
+		self._flag = Locator.small_vars.get_allocated()
+		self.test: str = self._flag
+		skip = f"If {self._flag}" if symbol == " et " else f"If non({self._flag})"
+
+		for n, operand in enumerate(operands):
+
+			if n:
+				self._lines.append(skip)
+
+			self._lines.append(f"{get_num_val(operand)}{ASS}{self._flag}")
+
+	def evaluate(self):
+		"""writes what computes the flag, if there is one"""
+
+		for line in self._lines:
+			wraw(line)
+
+	def free(self):
+
+		if self._flag is not None:
+			Locator.small_vars.free(self._flag)
+			self._flag = None
+
 class ControlFlow:
 
 	@property
@@ -752,33 +1436,188 @@ class ControlFlow:
 	def sanction(self) -> str: ...
 
 	def __enter__(self) -> ControlFlow:
+
+		self._intro: Mark = Locator.target_code.mark()
 		Locator.target_code.write_ln(self.introduction)
+		self._scope: Scope = Scope().__enter__()
+		Locator.blocks.append(self)
+		# lines after a break in this block, which never run
+		self._dead: Mark or None = None
+		# lines after a nested block that broke out of a loop, which only run if the loop goes on
+		self._guard: Mark or None = None
+		# how many variables the scope owned at these marks, those created after only exist past them
+		self._dead_owned: int = 0
+		self._guard_owned: int = 0
+		# the loops broken from inside this block, that it has to let the breaks through
+		self._breaks: set[Loop] = set()
 		return self
 
 	def __exit__(self, *args, **kwargs):
+
+		self.settle()
+		self._scope.__exit__(*args, **kwargs)
+		self.epilogue()
+		Locator.blocks.remove(self)
 		Locator.target_code.write_ln(self.sanction)
+		Locator.target_code.release(self._intro)
+
+		if pending := self._breaks - {self}:
+			Locator.blocks[-1].guard(pending)
+
+	def epilogue(self):
+		"""writes what ends the block body, once its variables are freed"""
+
+	def settle(self):
+		"""drops the code following a break and guards the code following a block that broke"""
+
+		code = Locator.target_code
+
+		if self._dead is not None:
+			# the variables of the dead code are never set, their frees go with it
+			self._scope.close(self._dead_owned)
+			code.delete(self._dead.index, len(code))
+			code.release(self._dead)
+			self._dead = None
+
+		if self._guard is not None:
+
+			# the variables of the guarded code are only set if the loop goes on, they are freed in the guard
+			self._scope.close(self._guard_owned)
+
+			if self._guard.index < len(code):
+				loop = next(block for block in reversed(Locator.blocks[:Locator.blocks.index(self) + 1]) if isinstance(block, Loop))
+				code.insert(self._guard.index, [f"If {loop.running}: Then"])
+				code.write_ln("End")
+
+			code.release(self._guard)
+			self._guard = None
+
+	def guard(self, loops: set[Loop]):
+
+		self._breaks |= loops
+
+		if self._guard is None and self._dead is None:
+			self._guard = Locator.target_code.mark()
+			self._guard_owned = len(self._scope)
+
+class Loop(ControlFlow):
+	"""a block that can be left early with Break"""
+
+	class NotInLoop(Exception): ...
+
+	def __enter__(self) -> Loop:
+
+		# set once a break needs a flag, which then tells if the loop was left
+		self._flag: str or None = None
+		# where the allocations of the loop start, the flag must not share a variable with them
+		self._positions: tuple[int, int] = (Locator.small_vars.position(), Locator.med_vars.position())
+		return ControlFlow.__enter__(self)
+
+	def __exit__(self, *args, **kwargs):
+
+		ControlFlow.__exit__(self, *args, **kwargs)
+
+		if self._flag is not None:
+			self._planner.free(self._flag.removeprefix("⌊RAM(").removesuffix(")"))
+
+	@property
+	def running(self) -> str:
+		"""a condition true as long as the loop was not broken"""
+		return f"non({self._flag})"
+
+	def exit(self):
+		"""writes what makes the loop stop at its End"""
+
+	def flag(self) -> str:
+		"""returns the flag of the loop, cleared before it starts"""
+
+		if self._flag is None:
 
-class While(ControlFlow):
+			# the flag must not share a variable with anything the loop already used
+			for planner, fmt, position in zip((Locator.small_vars, Locator.med_vars), ("{}", "⌊RAM({})"), self._positions):
+
+				if unused := planner.unused_since(position):
+					self._planner = planner
+					self._flag = fmt.format(planner.alloc(unused[0]))
+					break
+
+			else:
+				raise self.NotInLoop("no variable is left for the flag of a loop break")
+
+			Locator.target_code.insert(self._intro.index, [f"0{ASS}{self._flag}"])
+
+		return self._flag
+
+	def Break(self):
+		"""leaves the loop: the rest of the body is skipped and the loop stops at its End"""
+
+		if self not in Locator.blocks:
+			raise self.NotInLoop("Break called outside of its loop")
+
+		# the loops in between are left too
+		for block in reversed(Locator.blocks[Locator.blocks.index(self):]):
+			if isinstance(block, Loop):
+				block.exit()
+
+		innermost = Locator.blocks[-1]
+		innermost._breaks.add(self)
+
+		if innermost._dead is None:
+			innermost._dead = Locator.target_code.mark()
+			innermost._dead_owned = len(innermost._scope)
+
+class While(Loop):
 
 	def __init__(self, condition: NumVal):
 
 		self._condition: NumVal = condition
 
+	def __enter__(self) -> While:
+
+		# a short-circuited condition is computed before the loop and again before each back edge
+		self._test: Condition = Condition(self._condition)
+		self._test.evaluate()
+		return Loop.__enter__(self)
+
+	def __exit__(self, *args, **kwargs):
+
+		Loop.__exit__(self, *args, **kwargs)
+		self._test.free()
+
+	def epilogue(self):
+
+		if Locator.defrag_at_back_edges:
+			safe_point()
+
+		self._test.evaluate()
+
 	@property
 	def introduction(self) -> str:
-		return f"While {ExprRoot(self._condition).simplified_root().val}"
+
+		if self._flag is not None:
+			return f"While {self.running} et ({self._test.test})"
+
+		return f"While {self._test.test}"
 
 	@property
 	def sanction(self) -> str:
 		return "End"
 
+	def exit(self):
+
+		if self._flag is None:
+			self.flag()
+			Locator.target_code.rewrite(self._intro.index, self.introduction)
+
+		wraw(f"1{ASS}{self._flag}")
+
 def Range(size: NumVal) -> Tuple[NumVal, NumVal]:
-	return Const(0), get_num_val(size - Const(1))
+	return Const(0), size - Const(1)
 
 def Amount(n: NumVal) -> Tuple[NumVal, NumVal]:
 	return Const(1), n
 
-class For(ControlFlow):
+class For(Loop):
 
 	def __init__(self, svar: SmallVar or Ellipsis, start_: NumVal, end_: NumVal, step: NumVal = None):
 
@@ -795,8 +1634,12 @@ class For(ControlFlow):
 		self._step: NumVal or None = step
 
 	def __enter__(self) -> For:
-		Locator.target_code.write_ln(self.introduction)
-		return self
+		return Loop.__enter__(self)
+
+	def epilogue(self):
+
+		if self._is_temp:
+			self._svar.free()
 
 	@property
 	def var(self) -> SmallVar:
@@ -808,17 +1651,44 @@ class For(ControlFlow):
 
 	@property
 	def sanction(self) -> str:
+		return "End"
 
-		if self._is_temp:
-			del self._svar
+	@property
+	def sentinel(self) -> str or None:
+		"""a value past any end, for steps of known sign"""
 
-		return "End"
+		if self._step is None:
+			return "ᴇ99"
 
-	def Break(self):
+		step = ExprRoot(self._step).simplified_root()
 
-		self._svar.set(self._end + Const(1))
+		if isinstance(step, Neg) and isinstance(step.child, Const):
+			return "⁻ᴇ99"
+
+		if isinstance(step, Const):
+			return "⁻ᴇ99" if float(step.val) < 0 else "ᴇ99"
+
+		return None
+
+	@property
+	def running(self) -> str:
+		return f"{self._svar.val}≠{self.sentinel}" if self.sentinel is not None else Loop.running.fget(self)
+
+	def exit(self):
+
+		if self.sentinel is not None:
+			wraw(f"{self.sentinel}{ASS}{self._svar.val}")
+
+		# with a step of unknown sign the variable is put on the end, which the step then passes
+		else:
+			wraw(f"1{ASS}{self.flag()}")
+			self._svar.set(self._end)
 
 def Else():
+
+	block = Locator.blocks[-1]
+	block.settle()
+	Locator.scopes[-1].close()
 	wraw("Else")
 
 class If(ControlFlow):
@@ -827,16 +1697,24 @@ class If(ControlFlow):
 
 		self._condition: NumVal = condition
 
+	def __enter__(self) -> If:
+
+		self._test: Condition = Condition(self._condition)
+		self._test.evaluate()
+		# the flag is read by the If line only
+		self._test.free()
+		return ControlFlow.__enter__(self)
+
 	@property
 	def introduction(self) -> str:
-		return f"If {ExprRoot(self._condition).simplified_root().val}: Then"
+		return f"If {self._test.test}: Then"
 
 	@property
 	def sanction(self) -> str:
 		return "End"
 
-def Disp(var: NumVal or String or StringConst):
-	wraw("Disp " + get_num_val(var))
+def Disp(var: NumVal or StringVal):
+	wraw("Disp " + (var.val if isinstance(var, (String, StringConst, StringRaw)) else get_num_val(var)))
 
 def Input(prompt: String or StringConst, var: Var or String):
 	wraw(f"Input {prompt.val},{var.val}")
@@ -855,10 +1733,12 @@ class Array(Var):
 		self._ref_type: RefType = ref_type
 		self._lsize: int = eval(get_num_val(size))
 		self._addrs: list[str] = [Locator.med_vars.get_allocated() for _ in range(self._lsize)]
+		self._freed: bool = False
+		Locator.own(self)
 
 		if _init:
-			with For(..., Const(1), Const(self._lsize)) as forloop:
-				wraw(f"0{ASS}⌊RAM({forloop.var.val}")
+			with For(..., *Range(Const(self._lsize))) as forloop:
+				self[forloop.var].set(Const(0))
 
 	@property
 	def addr(self) -> str:
@@ -875,10 +1755,14 @@ class Array(Var):
 
 		return MedVar(addr=get_num_val(Const(self.addr) + key), ref_type=self._ref_type)
 
-	def __del__(self):
+	def free(self):
 
-		for addr in self._addrs:
-			Locator.med_vars.free(addr)
+		if not self._freed:
+
+			self._freed = True
+
+			for addr in self._addrs:
+				Locator.med_vars.free(addr)
 
 	def clone(self) -> Array:
 
@@ -889,8 +1773,8 @@ class Array(Var):
 
 		return clone
 
-def intpart(v: NumVal) -> NumRaw:
-	return NumRaw(f"partEnt({v})")
+def intpart(v: NumVal) -> IntPart:
+	return IntPart(v)
 
 def panic(text: String or StringConst):
 	Disp(text)
@@ -906,14 +1790,30 @@ class Vector(Var):
 		self._head: MedVar = MedVar()
 
 		self._addr = MedVar()
-		call("HNALLVEC", self._addr, get_num_val(initial_size))
+		call("HNALLVEC", self._addr, initial_size)
+		self._freed: bool = False
+		Locator.own(self)
+
+	def __getitem__(self, key: NumVal) -> StructMember:
+		return StructMember(self._addr.val, get_num_val(key), ref_type=self._ref_type)
 
-	def __getitem__(self, key: NumVal):
-		return RamAccess(get_num_val(self._addr + key), ref_type=self._ref_type)
+	def init(self, vals: list[NumVal]):
+		"""fills the first elements of a fresh vector"""
 
-	def __del__(self):
-		Locator.target_code.write_ln(f"0{ASS}⌊ADR({self._addr.val})")
-		del self._addr
+		for n, v in enumerate(vals):
+			self[Const(n)].set(v)
+
+		self._head.set(Const(len(vals)))
+
+	def free(self):
+
+		if not self._freed:
+
+			self._freed = True
+			free_mem(self._addr)
+
+			for var in (self._addr, self._head, self._size):
+				var.free()
 
 	def clone(self) -> Vector:
 
@@ -927,13 +1827,14 @@ class Vector(Var):
 	def expand(self, new_size: NumVal):
 		
 		old_addr = SmallVar(self._addr.val)
-		call("HNALLVEC", self._addr, get_num_val(new_size))
+		call("HNALLVEC", self._addr, new_size)
 
 		with For(..., *Range(self._size)) as fl:
-			RamAccess(self._addr + fl.var).set(self[fl.var])
+			self[fl.var].set(StructMember(old_addr.val, fl.var.val))
 
-		wraw(f"0{ASS}{L}ADR({old_addr.val}")
-		del old_addr
+		free_mem(old_addr)
+		old_addr.free()
+		self._size.set(new_size)
 
 	def push(self, v: NumVal):
 
@@ -949,19 +1850,16 @@ class Vector(Var):
 		self._head.decr()
 		return v
 
-@dataclass
-class FileContext:
-	filename: str
-	line_nbr: int
-
-	def __str__(self) -> str:
-		return f"{self.filename}@{str(self.line_nbr)}"
-
 class CoreType(Enum):
 
 	long = "long"
 	num = "num"
 	struct_instance = "struct instance"
+	string = "string"
+	array = "array"
+	vector = "vector"
+	trait_bound = "trait bound"
+	unit = "()"
 
 @dataclass
 class VarType:
@@ -985,6 +1883,37 @@ class StructInstanceType(VarType):
 	def clone(self) -> StructInstanceType:
 		return StructInstanceType(ref_type=self.ref_type, core_type=self.core_type, borrowed=self.borrowed, struct_type=self.struct_type)
 
+@dataclass
+class ArrayType(VarType):
+	item: VarType
+	size: int
+
+	def __eq__(self, other: ArrayType) -> bool:
+		return VarType.__eq__(self, other) and isinstance(other, ArrayType) and self.item == other.item and self.size == other.size
+
+	def clone(self) -> ArrayType:
+		return ArrayType(ref_type=self.ref_type, core_type=self.core_type, borrowed=self.borrowed, item=self.item, size=self.size)
+
+@dataclass
+class VectorType(VarType):
+	item: VarType
+
+	def __eq__(self, other: VectorType) -> bool:
+		return VarType.__eq__(self, other) and isinstance(other, VectorType) and self.item == other.item
+
+	def clone(self) -> VectorType:
+		return VectorType(ref_type=self.ref_type, core_type=self.core_type, borrowed=self.borrowed, item=self.item)
+
+@dataclass
+class TraitBoundType(VarType):
+	trait: Trait
+
+	def __eq__(self, other: TraitBoundType) -> bool:
+		return VarType.__eq__(self, other) and isinstance(other, TraitBoundType) and self.trait == other.trait
+
+	def clone(self) -> TraitBoundType:
+		return TraitBoundType(ref_type=self.ref_type, core_type=self.core_type, borrowed=self.borrowed, trait=self.trait)
+
 class IncoherentType(Exception): ...
 
 def get_fmt_type(t: VarType) -> str:
@@ -1012,6 +1941,27 @@ def get_fmt_type(t: VarType) -> str:
 			assert isinstance(t, StructInstanceType)
 			return t.struct_type.name
 
+		elif t.core_type == CoreType.string:
+			return "string"
+
+		elif t.core_type == CoreType.unit:
+			return "()"
+
+		elif t.core_type == CoreType.trait_bound:
+
+			assert isinstance(t, TraitBoundType)
+			return f"impl {t.trait.name}"
+
+		elif t.core_type == CoreType.array:
+
+			assert isinstance(t, ArrayType)
+			return f"{get_fmt_type(t.item)}[{t.size}]"
+
+		elif t.core_type == CoreType.vector:
+
+			assert isinstance(t, VectorType)
+			return f"{get_fmt_type(t.item)}<>"
+
 		else:
 			raise Exception(f"cant get name of core type {t.core_type}")
 
@@ -1024,29 +1974,95 @@ def get_fmt_type(t: VarType) -> str:
 def get_fn_signature(name: str, ret: VarType, args: list[VarType]) -> str:
 	return f"{name} (" + ", ".join(get_fmt_type(e) for e in args) + f") -> {get_fmt_type(ret)}"
 
+# struct and trait types are interned: each definition gets an id once and
+# is compared by it, and its methods are looked up in a table built as they are bound
+_type_ids = count()
+
 class StructType:
+
+	class MethodDefinedTwice(Exception): ...
 	
 	def __init__(self, name: str, members: tuple[tuple[str, VarType]]):
 		
+		self._id: int = next(_type_ids)
 		self._members: tuple[tuple[str, VarType]] = members
 		self._name: str = name
 		self._methods: dict[str, Callable] = {}
+		self._table: dict[str, Callable] = {}
 
 	def get_signature(self) -> str:
 		return self._name + " {\n" + "\n\t".join(f"{name}: {get_fmt_type(t)}" for (name, t) in self._members) + "\n} {" + "\n\t".join(name for name in self._methods) + "\n}"
 
 	def __eq__(self, other: StructType) -> bool:
-		return self.get_signature() == other.get_signature()
+		return isinstance(other, StructType) and self._id == other._id
+
+	def __hash__(self) -> int:
+		return self._id
+
+	@property
+	def id(self) -> int:
+		return self._id
 
 	@property
 	def name(self) -> str:
 		return self._name
 
-	def bind_method(self, signature: str, fn: Callable):
+	@property
+	def members(self) -> tuple[tuple[str, VarType]]:
+		return self._members
+
+	def set_members(self, members: tuple[tuple[str, VarType]]):
+		"""sets the members once they are resolved, they may refer to the struct itself"""
+		self._members = members
+
+	def bind_method(self, signature: str, fn: Callable, name: str or None = None):
+		"""binds a method, the methods of every impl and trait of the struct being called by name alike"""
+
+		if name is not None and name in self._table:
+			raise self.MethodDefinedTwice(f"{self._name} already has a method called {name}")
+
 		self._methods[signature] = fn
 
+		if name is not None:
+			self._table[name] = fn
+
 	def get_method(self, signature: str) -> Callable:
 		return self._methods[signature]
 
+	def method(self, name: str) -> Callable or None:
+		"""returns the method called name, without building its signature"""
+		return self._table.get(name)
+
 class Trait:
-	pass
+
+	def __init__(self, name: str, methods: tuple[str, ...]):
+
+		self._id: int = next(_type_ids)
+		self._name: str = name
+		self._methods: tuple[str, ...] = methods
+		# ids of the struct types implementing the trait, their methods are bound to them
+		self._impls: set[int] = set()
+
+	def __eq__(self, other: Trait) -> bool:
+		return isinstance(other, Trait) and self._id == other._id
+
+	def __hash__(self) -> int:
+		return self._id
+
+	@property
+	def id(self) -> int:
+		return self._id
+
+	@property
+	def name(self) -> str:
+		return self._name
+
+	@property
+	def methods(self) -> tuple[str, ...]:
+		return self._methods
+
+	def implement(self, struct_type: StructType):
+		self._impls.add(struct_type.id)
+
+	def implemented_by(self, struct_type: StructType) -> bool:
+		return struct_type.id in self._impls